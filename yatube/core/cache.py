@@ -0,0 +1,203 @@
+"""Кэш страниц, который сбрасывается поколениями.
+
+У каждой области (лента, группа, автор, пост) есть счетчик поколения.
+Ключ страницы включает поколения областей, от которых она зависит,
+поэтому после записи достаточно увеличить счетчик: старые страницы
+перестают находиться и вытесняются по таймауту.
+
+Запись кэша живет дольше своего срока свежести: устаревшую страницу
+отдают, пока ее пересобирает ровно один процесс (single flight), а
+одновременные промахи по одному ключу ждут результат этого процесса.
+
+Области, которые view узнает только из базы (id автора по имени в
+адресе), в ключ не входят: view добавляет их через depend_on, их
+поколения хранятся вместе со страницей и сверяются при чтении.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .metrics import cache_access
+
+GENERATION_PREFIX = 'generation:'
+LOCK_PREFIX = 'lock:'
+POLL_INTERVAL = 0.05
+
+
+def _generation_key(scope):
+    return GENERATION_PREFIX + scope
+
+
+def _initial_generation():
+    # После очистки кэша поколение не должно совпасть с прежним,
+    # поэтому отсчет начинается с текущего времени.
+    return time.time_ns()
+
+
+def get_generations(scopes):
+    """Текущие поколения областей в порядке scopes."""
+    keys = [_generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _initial_generation(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def _increment(scopes):
+    for scope in scopes:
+        key = _generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_generation(), None)
+
+
+def bump(*scopes):
+    """Сбрасывает страницы, зависящие от областей scopes.
+
+    Внутри транзакции поколение меняется еще раз после ее фиксации.
+    До фиксации соседний процесс может прочитать новое поколение,
+    собрать страницу из старых данных и сохранить ее под новым ключом;
+    второй сброс делает этот ключ ненужным. Первый нужен самой
+    транзакции, чтобы она видела свои изменения.
+    """
+    _increment(scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _increment(scopes))
+
+
+def page_key(request, scopes):
+    """Ключ страницы по адресу и поколениям.
+
+    Страница общая для всех пользователей: персональные части
+    подставляются после кэша, см. core.fragments.
+    """
+    generations = ':'.join(str(g) for g in get_generations(scopes))
+    raw = f'{request.get_full_path()}|{generations}'
+    return 'page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def depend_on(request, *scopes):
+    """Добавляет странице области, известные только из базы.
+
+    Поколения запоминаются в момент вызова, поэтому view вызывает его
+    сразу, как узнает id. Вне кэшируемого view ничего не делает.
+    """
+    dependencies = getattr(request, 'cache_dependencies', None)
+    if dependencies is not None:
+        dependencies.update(zip(scopes, get_generations(scopes)))
+
+
+def _is_current(value):
+    """Поколения областей из depend_on не менялись после сборки."""
+    dependencies = value[1]
+    return get_generations(list(dependencies)) == list(
+        dependencies.values()
+    )
+
+
+def is_cacheable(request, response):
+    """Кэшируются только общие успешные ответы без установки cookie."""
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+    )
+
+
+def _store(key, value, timeout):
+    fresh_until = time.time() + timeout
+    cache.set(key, (fresh_until, value),
+              timeout + settings.PAGE_CACHE_STALE_TIMEOUT)
+
+
+def _get(key, is_current):
+    entry = cache.get(key)
+    if entry is None or is_current is None or is_current(entry[1]):
+        return entry
+    return None
+
+
+def _wait_for(key, is_current):
+    """Ждет, пока значение соберет процесс, взявший блокировку."""
+    deadline = time.monotonic() + settings.PAGE_CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = _get(key, is_current)
+        if entry is not None:
+            return entry
+        if LOCK_PREFIX + key not in cache:
+            break
+    return None
+
+
+def single_flight(key, produce, timeout, is_current=None):
+    """Значение из кэша с пересборкой в одном процессе.
+
+    produce() возвращает пару (значение, можно ли его кэшировать).
+    Свежее значение отдается сразу. Устаревшее отдается, пока его
+    пересобирает процесс, первым взявший блокировку. При промахе
+    остальные процессы ждут до PAGE_CACHE_WAIT секунд и собирают
+    значение сами, только если не дождались. Значение, для которого
+    is_current(value) ложно, считается отсутствующим.
+    """
+    entry = _get(key, is_current)
+    if entry is not None and entry[0] > time.time():
+        cache_access('page', 'hit')
+        return entry[1]
+    lock_key = LOCK_PREFIX + key
+    locked = cache.add(lock_key, 1, settings.PAGE_CACHE_LOCK_TIMEOUT)
+    if not locked:
+        if entry is not None:
+            cache_access('page', 'stale')
+            return entry[1]
+        entry = _wait_for(key, is_current)
+        if entry is not None:
+            cache_access('page', 'hit')
+            return entry[1]
+    cache_access('page', 'miss')
+    try:
+        value, cacheable = produce()
+        if cacheable:
+            _store(key, value, timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
+
+
+def cache_page_by_generation(scopes, timeout=None):
+    """Кэширует GET-ответ view до смены поколения областей.
+
+    scopes — функция, которая по аргументам view возвращает имена
+    областей, например ('posts', 'post:7'). Остальные области view
+    добавляет через depend_on.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key = page_key(request, scopes(request, *args, **kwargs))
+
+            def produce():
+                request.cache_dependencies = {}
+                response = view(request, *args, **kwargs)
+                value = response, request.cache_dependencies
+                return value, is_cacheable(request, response)
+
+            response, _ = single_flight(
+                key, produce,
+                settings.PAGE_CACHE_TIMEOUT if timeout is None else timeout,
+                _is_current
+            )
+            return response
+        return wrapper
+    return decorator
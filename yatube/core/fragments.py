@@ -0,0 +1,57 @@
+"""Персональные фрагменты страниц (hole punching).
+
+Общая часть страницы рендерится и кэшируется одна на всех. На месте
+всего, что зависит от пользователя, шаблон тегом {% personal %}
+оставляет подписанную метку, а PersonalFragmentsMiddleware подставляет
+вместо нее фрагмент, отрендеренный для текущего запроса.
+"""
+import re
+
+from django.core import signing
+from django.template.loader import render_to_string
+
+SALT = 'core.fragments'
+MARKER = '<!--personal '
+PATTERN = re.compile(r'<!--personal ([\w-]+) (\S+?)-->')
+
+_registry = {}
+
+
+def register(name, template_name):
+    """Регистрирует фрагмент: функция по запросу возвращает контекст."""
+    def decorator(func):
+        _registry[name] = (template_name, func)
+        return func
+    return decorator
+
+
+def placeholder(name, **kwargs):
+    """Метка фрагмента для общей части страницы."""
+    token = signing.dumps(kwargs, salt=SALT, compress=True)
+    return f'{MARKER}{name} {token}-->'
+
+
+def render_fragment(request, name, kwargs):
+    template_name, get_context = _registry[name]
+    return render_to_string(
+        template_name, get_context(request, **kwargs), request=request
+    )
+
+
+def stitch(request, content):
+    """Подставляет персональные фрагменты на место меток."""
+    def replace(match):
+        name, token = match.groups()
+        if name not in _registry:
+            return ''
+        try:
+            kwargs = signing.loads(token, salt=SALT)
+        except signing.BadSignature:
+            return ''
+        return render_fragment(request, name, kwargs)
+    return PATTERN.sub(replace, content)
+
+
+@register('header', 'includes/header.html')
+def header(request):
+    return {}
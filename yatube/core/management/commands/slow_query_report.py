@@ -0,0 +1,115 @@
+import glob
+import gzip
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.slow_queries import fingerprint, normalize
+
+SQL_WIDTH = 300
+
+
+class Stats:
+    """Записи журнала с одним отпечатком запроса."""
+
+    def __init__(self, sql):
+        self.sql = normalize(sql)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.views = Counter()
+        self.stacks = Counter()
+        self.templates = Counter()
+
+    def add(self, entry):
+        duration = entry['duration_ms']
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.views[entry.get('view') or '-'] += 1
+        self.stacks[' <- '.join(entry.get('stack') or ()) or '-'] += 1
+        if entry.get('template'):
+            self.templates[entry['template']] += 1
+
+
+def top(counter, limit=3):
+    return ', '.join(f'{name} ({count})'
+                     for name, count in counter.most_common(limit))
+
+
+class Command(BaseCommand):
+    help = ('Сводка журнала медленных запросов: самые дорогие запросы по '
+            'отпечатку, с view и местами вызова.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Файлы журнала. По умолчанию SLOW_QUERY_LOG и его '
+                 'ротированные копии, в том числе сжатые (.gz).'
+        )
+        parser.add_argument(
+            '--top', type=int, default=10,
+            help='Сколько запросов показать.'
+        )
+        parser.add_argument(
+            '--sort', choices=('total', 'count', 'max'), default='total',
+            help='Порядок: суммарное время, число записей или худшее время.'
+        )
+
+    def read(self, paths):
+        """Записи журнала; строки не в JSON пропускаются и считаются."""
+        for path in paths:
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        entry['duration_ms'] = float(entry['duration_ms'])
+                        entry['sql'] = str(entry['sql'])
+                    except (ValueError, TypeError, KeyError):
+                        self.skipped += 1
+                        continue
+                    yield entry
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or sorted(
+            glob.glob(glob.escape(settings.SLOW_QUERY_LOG) + '*')
+        )
+        if not paths:
+            raise CommandError('Журнал медленных запросов пуст.')
+        self.skipped = 0
+        found = {}
+        for entry in self.read(paths):
+            key = fingerprint(entry['sql'])
+            if key not in found:
+                found[key] = Stats(entry['sql'])
+            found[key].add(entry)
+        ranked = sorted(
+            found.items(), key=lambda item: getattr(item[1], options['sort']),
+            reverse=True,
+        )[:options['top']]
+        for place, (key, stats) in enumerate(ranked, 1):
+            self.stdout.write(
+                f'#{place} {key}: записей {stats.count}, всего '
+                f'{stats.total:.1f} мс, в среднем '
+                f'{stats.total / stats.count:.1f} мс, худшее '
+                f'{stats.max:.1f} мс'
+            )
+            self.stdout.write(f'  view: {top(stats.views)}')
+            self.stdout.write(f'  вызов: {top(stats.stacks)}')
+            if stats.templates:
+                self.stdout.write(f'  шаблон: {top(stats.templates)}')
+            sql = stats.sql
+            if len(sql) > SQL_WIDTH:
+                sql = sql[:SQL_WIDTH] + '…'
+            self.stdout.write(f'  {sql}')
+        if self.skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Пропущено нечитаемых строк: {self.skipped}'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: записей {sum(s.count for s in found.values())}, '
+            f'разных запросов {len(found)}'
+        ))
@@ -0,0 +1,165 @@
+"""Раздача загруженных файлов (MEDIA_ROOT).
+
+Имена файлов не переиспользуются: картинки постов называются хэшем
+содержимого (core.storage), миниатюры — ключом исходника и опций, а
+FileSystemStorage не перезаписывает существующие файлы. Поэтому файл
+кэшируется браузером на MEDIA_CACHE_MAX_AGE как immutable.
+
+Если задан MEDIA_SENDFILE_HEADER, view только проверяет запрос и
+условные заголовки, а сам файл (вместе с Range) отдает фронтовой
+сервер: X-Sendfile получает путь к файлу, X-Accel-Redirect — адрес
+внутреннего location из MEDIA_SENDFILE_URL.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class FileRange:
+    """Часть файла для FileResponse: length байт с позиции start."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def byte_range(header, size):
+    """Первый и последний байт из заголовка Range.
+
+    None — отдать файл целиком: заголовка нет, он не разобран или
+    просит несколько диапазонов.
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-500: последние 500 байт
+        if int(last) == 0:
+            raise RangeNotSatisfiable
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def if_range_matches(request, etag, last_modified):
+    """Совпадает ли If-Range с текущей версией файла."""
+    value = request.META.get('HTTP_IF_RANGE')
+    if value is None:
+        return True
+    if value.startswith(('"', 'W/')):
+        return value == etag
+    return parse_http_date_safe(value) == last_modified
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(
+        response, public=True, immutable=True,
+        max_age=settings.MEDIA_CACHE_MAX_AGE,
+    )
+    return response
+
+
+def sendfile_response(path, fullpath, content_type):
+    response = HttpResponse(content_type=content_type)
+    header = settings.MEDIA_SENDFILE_HEADER
+    if header == 'X-Accel-Redirect':
+        response[header] = settings.MEDIA_SENDFILE_URL + quote(path)
+    else:
+        response[header] = fullpath
+    return response
+
+
+def file_response(request, fullpath, content_type, size, etag,
+                  last_modified):
+    try:
+        requested = byte_range(request.META.get('HTTP_RANGE'), size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    file = open(fullpath, 'rb')
+    if requested is None or not if_range_matches(request, etag,
+                                                 last_modified):
+        response = FileResponse(file, content_type=content_type)
+    else:
+        first, last = requested
+        length = last - first + 1
+        response = FileResponse(
+            FileRange(file, first, length), content_type=content_type,
+            status=206,
+        )
+        response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def media_file(path):
+    """Полный путь и stat файла в MEDIA_ROOT или Http404."""
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(fullpath)
+    except (SuspiciousFileOperation, FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+    return fullpath, stat
+
+
+@require_safe
+def serve_media(request, path):
+    path = posixpath.normpath(path).lstrip('/')
+    fullpath, stat = media_file(path)
+    last_modified = int(stat.st_mtime)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        content_type = (
+            mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        )
+        if settings.MEDIA_SENDFILE_HEADER:
+            response = sendfile_response(path, fullpath, content_type)
+        else:
+            response = file_response(
+                request, fullpath, content_type, stat.st_size, etag,
+                last_modified,
+            )
+    if response.status_code in (412, 416):
+        return response
+    return set_validators(response, etag, last_modified)
@@ -0,0 +1,286 @@
+"""Метрики запросов в текстовом формате Prometheus.
+
+MetricsMiddleware замеряет каждый ответ: время, число и время
+SQL-запросов, обращения к кэшу страниц и карточек и размер. Метка
+view — имя URL (posts:profile); у адресов, которые не разобрал
+URLconf, она равна UNRESOLVED, чтобы случайные адреса не плодили
+новые ряды.
+
+Значения копятся в памяти процесса, и воркеры не видят счетчики друг
+друга. Если задан METRICS_DIR, процесс не реже раза в
+METRICS_FLUSH_INTERVAL секунд записывает снимок в свой файл, а
+/metrics складывает снимки всех процессов. Каталог стоит очищать при
+перезапуске сервиса: Prometheus считает падение счетчика сбросом.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_safe
+
+UNRESOLVED = 'unresolved'
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+HISTOGRAMS = {
+    'yatube_request_duration_seconds': (
+        'Время ответа.', LATENCY_BUCKETS
+    ),
+    'yatube_request_db_queries': (
+        'Число SQL-запросов за ответ.', QUERY_BUCKETS
+    ),
+    'yatube_request_db_duration_seconds': (
+        'Время SQL-запросов за ответ.', LATENCY_BUCKETS
+    ),
+    'yatube_response_size_bytes': (
+        'Размер тела ответа.', SIZE_BUCKETS
+    ),
+}
+COUNTERS = {
+    'yatube_requests_total': 'Ответы по методу и коду.',
+    'yatube_cache_requests_total': 'Обращения к кэшу страниц и карточек.',
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_local = threading.local()
+
+
+class RequestStats:
+    """Запросы к БД и кэшу за один ответ.
+
+    Экземпляр служит и оберткой execute_wrapper для соединений.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+def cache_access(cache_name, result, count=1):
+    """Учитывает обращения к кэшу в метриках текущего ответа."""
+    stats = getattr(_local, 'stats', None)
+    if stats is not None and count:
+        stats.cache[cache_name, result] += count
+
+
+class Registry:
+    """Счетчики и гистограммы процесса.
+
+    Ключ ряда — (имя метрики, метки), метки — кортеж пар. У гистограммы
+    хранится число значений в каждой корзине (последняя — +Inf) и их
+    сумма.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.next_flush = 0.0
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        series = self.histograms.get((name, labels))
+        if series is None:
+            series = self.histograms[name, labels] = [
+                [0] * (len(buckets) + 1), 0.0
+            ]
+        series[0][bisect_left(buckets, value)] += 1
+        series[1] += value
+
+    def record(self, request, response, elapsed, stats):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else UNRESOLVED
+        method = request.method if request.method in METHODS else 'other'
+        labels = (('view', view),)
+        size = response_size(response)
+        with self.lock:
+            self.counters['yatube_requests_total', (
+                ('view', view), ('method', method),
+                ('status', str(response.status_code)),
+            )] += 1
+            self.observe('yatube_request_duration_seconds', labels, elapsed)
+            self.observe('yatube_request_db_queries', labels, stats.queries)
+            self.observe(
+                'yatube_request_db_duration_seconds', labels, stats.db_time
+            )
+            if size is not None:
+                self.observe('yatube_response_size_bytes', labels, size)
+            for (cache_name, result), count in stats.cache.items():
+                self.counters['yatube_cache_requests_total', (
+                    ('view', view), ('cache', cache_name),
+                    ('result', result),
+                )] += count
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [
+                    [name, labels, value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                'histograms': [
+                    [name, labels, counts[:], total]
+                    for (name, labels), (counts, total)
+                    in self.histograms.items()
+                ],
+            }
+
+    def flush(self, directory):
+        """Записывает снимок процесса в его файл в directory."""
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, os.path.join(directory, f'{os.getpid()}.json'))
+
+    def maybe_flush(self):
+        directory = settings.METRICS_DIR
+        now = time.monotonic()
+        if not directory or now < self.next_flush:
+            return
+        self.next_flush = now + settings.METRICS_FLUSH_INTERVAL
+        self.flush(directory)
+
+
+registry = Registry()
+
+
+def response_size(response):
+    """Размер тела или None, если потоковый ответ его не сообщил."""
+    if not response.streaming:
+        return len(response.content)
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    return None
+
+
+def snapshots():
+    """Снимки всех процессов: свой берется из памяти, а не из файла."""
+    yield registry.snapshot()
+    directory = settings.METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return
+    own = f'{os.getpid()}.json'
+    for name in os.listdir(directory):
+        if name == own or not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                yield json.load(file)
+        except (OSError, ValueError):
+            # Процесс мог завершиться или еще дописывать файл
+            continue
+
+
+def merge(parts):
+    """Складывает снимки в словари счетчиков и гистограмм."""
+    counters, histograms = defaultdict(float), {}
+    for part in parts:
+        for name, labels, value in part['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, counts, total in part['histograms']:
+            key = name, tuple(map(tuple, labels))
+            if key not in histograms:
+                histograms[key] = [[0] * len(counts), 0.0]
+            series = histograms[key]
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+    return counters, histograms
+
+
+def format_labels(labels):
+    def escape(value):
+        return (value.replace('\\', r'\\').replace('"', r'\"')
+                .replace('\n', r'\n'))
+
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+
+
+def format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render(counters, histograms):
+    """Текст в формате Prometheus, ряды отсортированы по меткам."""
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (series, labels), value in sorted(counters.items()):
+            if series == name:
+                lines.append(
+                    f'{name}{{{format_labels(labels)}}} {format_value(value)}'
+                )
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (series, labels), (counts, total) in sorted(histograms.items()):
+            if series != name:
+                continue
+            cumulative = 0
+            bounds = [repr(float(bound)) for bound in buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                bucket_labels = format_labels(labels + (('le', bound),))
+                lines.append(f'{name}_bucket{{{bucket_labels}}} {cumulative}')
+            lines += [
+                f'{name}_sum{{{format_labels(labels)}}} {format_value(total)}',
+                f'{name}_count{{{format_labels(labels)}}} {cumulative}',
+            ]
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Замеряет ответы для /metrics.
+
+    Стоит первым после отладочной панели, чтобы время включало работу
+    остальных middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = _local.stats = RequestStats()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(stats)
+                    )
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        registry.record(request, response, time.perf_counter() - start,
+                        stats)
+        registry.maybe_flush()
+        return response
+
+
+@never_cache
+@require_safe
+def metrics(request):
+    """Метрики для Prometheus; с чужих адресов страницы нет."""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(render(*merge(snapshots())),
+                        content_type=CONTENT_TYPE)
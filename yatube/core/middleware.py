@@ -0,0 +1,27 @@
+from django.utils.encoding import force_str
+
+from . import fragments
+
+
+class PersonalFragmentsMiddleware:
+    """Вставляет персональные фрагменты в общую часть страницы.
+
+    Должен стоять ниже CsrfViewMiddleware: фрагменты с формами
+    выдают CSRF-токен, и cookie должна попасть в ответ.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (response.streaming
+                or 'text/html' not in response.get('Content-Type', '')):
+            return response
+        content = force_str(response.content, response.charset)
+        if fragments.MARKER not in content:
+            return response
+        response.content = fragments.stitch(request, content)
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+        return response
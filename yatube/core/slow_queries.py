@@ -0,0 +1,175 @@
+"""Журнал медленных SQL-запросов.
+
+SlowQueryMiddleware на время ответа оборачивает выполнение запросов
+всех соединений. Запрос дольше SLOW_QUERY_THRESHOLD секунд пишется в
+логгер core.slow_queries строкой JSON: SQL, время, view и место
+вызова — до STACK_DEPTH ближайших к запросу кадров кода проекта
+(posts/utils.py, затем posts/views.py, откуда его вызвали) и узел
+шаблона, если запрос выполнен при рендеринге.
+
+Параметры запроса в журнал не попадают: в них бывают личные данные.
+Из медленных запросов записывается доля SLOW_QUERY_SAMPLE_RATE и не
+больше SLOW_QUERY_MAX_PER_MINUTE в минуту на процесс; сколько записей
+отброшено лимитом, сообщает следующая запись. Стек разбирается только
+для записей, которые точно попадут в журнал.
+
+Отчет по журналу строит команда slow_query_report.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import TokenType
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+SPACE = re.compile(r'\s+')
+STACK_DEPTH = 5
+# Кадры самих оберток местом вызова не считаются
+IGNORED_FILES = {
+    os.path.splitext(path)[0] for path in (__file__, metrics.__file__)
+}
+
+
+def normalize(sql):
+    """SQL без значений: литералы и параметры заменены на ?."""
+    sql = LITERAL.sub('?', sql.replace('%s', '?'))
+    sql = PLACEHOLDER_LIST.sub('(...)', sql)
+    return SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    """Отпечаток запроса: одинаковый у запросов с разными значениями."""
+    return hashlib.md5(normalize(sql).encode()).hexdigest()[:12]
+
+
+def template_node(frame):
+    """'шаблон:строка {{ узел }}' для кадра Node.render_annotated."""
+    node = frame.f_locals.get('self')
+    token = getattr(node, 'token', None)
+    origin = getattr(node, 'origin', None)
+    if token is None or origin is None:
+        return None
+    tag = ('{{ %s }}' if token.token_type == TokenType.VAR
+           else '{%% %s %%}') % token.contents
+    return f'{origin.template_name}:{token.lineno} {tag}'
+
+
+def call_site(frame):
+    """Кадры кода проекта и узел шаблона выше кадра frame."""
+    root = os.path.join(settings.BASE_DIR, '')
+    stack, template = [], None
+    while frame is not None:
+        code = frame.f_code
+        filename = code.co_filename
+        if (len(stack) < STACK_DEPTH and filename.startswith(root)
+                and 'site-packages' not in filename
+                and os.path.splitext(filename)[0] not in IGNORED_FILES):
+            path = os.path.relpath(filename, settings.BASE_DIR)
+            stack.append(f'{path}:{frame.f_lineno} in {code.co_name}')
+        if template is None and code.co_name == 'render_annotated':
+            template = template_node(frame)
+        frame = frame.f_back
+    return stack, template
+
+
+class RateLimiter:
+    """Корзина токенов: в среднем не больше limit событий в минуту."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = None
+        self.updated = time.monotonic()
+        self.dropped = 0
+
+    def allow(self, limit):
+        """Число отброшенных до этого событий или None, если нельзя."""
+        with self.lock:
+            now = time.monotonic()
+            if self.tokens is None:
+                self.tokens = limit
+            self.tokens = min(
+                limit, self.tokens + (now - self.updated) * limit / 60
+            )
+            self.updated = now
+            if self.tokens < 1:
+                self.dropped += 1
+                return None
+            self.tokens -= 1
+            dropped, self.dropped = self.dropped, 0
+            return dropped
+
+
+limiter = RateLimiter()
+
+
+class SlowQueryLog:
+    """Обертка execute_wrapper, которая пишет медленные запросы."""
+
+    def __init__(self, request=None):
+        self.request = request
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            if duration >= settings.SLOW_QUERY_THRESHOLD:
+                self.report(sql, duration, sys._getframe(1))
+
+    def report(self, sql, duration, frame):
+        if random.random() >= settings.SLOW_QUERY_SAMPLE_RATE:
+            return
+        dropped = limiter.allow(settings.SLOW_QUERY_MAX_PER_MINUTE)
+        if dropped is None:
+            return
+        stack, template = call_site(frame)
+        match = getattr(self.request, 'resolver_match', None)
+        entry = {
+            'time': timezone.now().isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'fingerprint': fingerprint(sql),
+            'sql': sql,
+            'view': match.view_name if match else None,
+            'path': getattr(self.request, 'path', None),
+            'stack': stack,
+            'template': template,
+            'dropped': dropped,
+        }
+        logger.warning(json.dumps(entry, ensure_ascii=False))
+
+
+class SlowQueryMiddleware:
+    """Включает журнал медленных запросов на время ответа.
+
+    При SLOW_QUERY_THRESHOLD = None журнал выключен.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.SLOW_QUERY_THRESHOLD is None:
+            return self.get_response(request)
+        wrapper = SlowQueryLog(request)
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(wrapper)
+                )
+            return self.get_response(request)
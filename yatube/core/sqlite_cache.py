@@ -0,0 +1,281 @@
+"""Общий для всех процессов кэш в файле SQLite.
+
+LocMemCache у каждого процесса свой: с ростом числа воркеров падает
+доля попаданий, а сброс поколений (core.cache) не доходит до соседей.
+Этот бэкенд хранит записи в одном файле SQLite в режиме WAL, поэтому
+его видят все процессы на машине без отдельного сервера. Чтение не
+кэшируется в памяти процесса: удаление и запись видны остальным
+сразу после фиксации транзакции.
+
+Размер ограничен MAX_SIZE байт (и MAX_ENTRIES записей): при
+превышении сначала удаляются просроченные записи, затем давно не
+читавшиеся (LRU).
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.sqlite_cache.SQLiteCache',
+            'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+            'OPTIONS': {'MAX_SIZE': 64 * 1024 * 1024},
+        }
+    }
+"""
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    size INTEGER NOT NULL,
+    entries INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_stats VALUES (1, 0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+    UPDATE cache_stats SET size = size + NEW.size, entries = entries + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache
+BEGIN
+    UPDATE cache_stats SET size = size - OLD.size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+    UPDATE cache_stats SET size = size - OLD.size, entries = entries - 1;
+END;
+'''
+
+UPSERT = '''
+INSERT INTO cache (key, value, expires, accessed, size)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    value = excluded.value, expires = excluded.expires,
+    accessed = excluded.accessed, size = excluded.size
+'''
+
+
+class SQLiteCache(BaseCache):
+    # Время чтения записывается не чаще раза в ACCESS_RESOLUTION
+    # секунд, чтобы попадание в кэш почти никогда не писало в файл.
+    ACCESS_RESOLUTION = 1
+    DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+    BUSY_TIMEOUT = 5
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        options = params.get('OPTIONS', {})
+        self._max_size = int(options.get('MAX_SIZE', self.DEFAULT_MAX_SIZE))
+        if 'max_entries' not in params and 'MAX_ENTRIES' not in options:
+            # Основное ограничение — размер, число записей не важно.
+            self._max_entries = sys.maxsize
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        # Соединение свое у каждого потока и процесса: после fork
+        # наследованное соединение использовать нельзя.
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(
+                self._path, timeout=self.BUSY_TIMEOUT,
+                isolation_level=None, check_same_thread=False,
+            )
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+    def _expires(self, timeout):
+        return self.get_backend_timeout(timeout)
+
+    def _touch_accessed(self, keys, now):
+        self._db.executemany(
+            'UPDATE cache SET accessed = ? WHERE key = ? AND accessed < ?',
+            [(now, key, now - self.ACCESS_RESOLUTION) for key in keys],
+        )
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._get_many([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        made = {self.make_key(key, version=version): key for key in keys}
+        for key in made:
+            self.validate_key(key)
+        found = self._get_many(list(made))
+        return {made[key]: value for key, value in found.items()}
+
+    def _get_many(self, keys):
+        if not keys:
+            return {}
+        now = time.time()
+        rows = self._db.execute(
+            'SELECT key, value, accessed FROM cache WHERE key IN (%s)'
+            ' AND (expires IS NULL OR expires > ?)'
+            % ', '.join('?' * len(keys)),
+            [*keys, now],
+        ).fetchall()
+        stale = [
+            key for key, _, accessed in rows
+            if accessed < now - self.ACCESS_RESOLUTION
+        ]
+        if stale:
+            self._touch_accessed(stale, now)
+        return {key: pickle.loads(value) for key, value, _ in rows}
+
+    def _row(self, value, timeout, now):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return sqlite3.Binary(data), self._expires(timeout), now, len(data)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        rows = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            rows.append((key, *self._row(value, timeout, now)))
+        with self._transaction() as db:
+            db.executemany(UPSERT, rows)
+            self._cull(db, now)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now)
+            )
+            cursor = db.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires,'
+                ' accessed, size) VALUES (?, ?, ?, ?, ?)',
+                (key, *self._row(value, timeout, now)),
+            )
+            if cursor.rowcount:
+                self._cull(db, now)
+        return bool(cursor.rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        # Значения хранятся в pickle, поэтому читаем и пишем в одной
+        # транзакции с блокировкой записи: конкурентные incr не теряются.
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ?'
+                ' AND (expires IS NULL OR expires > ?)', (key, now),
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            db.execute(
+                'UPDATE cache SET value = ?, size = ?, accessed = ?'
+                ' WHERE key = ?', (sqlite3.Binary(data), len(data), now, key),
+            )
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        cursor = self._db.execute(
+            'UPDATE cache SET expires = ?, accessed = ? WHERE key = ?'
+            ' AND (expires IS NULL OR expires > ?)',
+            (self._expires(timeout), now, key, now),
+        )
+        return bool(cursor.rowcount)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._db.execute(
+            'SELECT 1 FROM cache WHERE key = ?'
+            ' AND (expires IS NULL OR expires > ?)', (key, time.time()),
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        made = [self.make_key(key, version=version) for key in keys]
+        for key in made:
+            self.validate_key(key)
+        if made:
+            self._db.execute(
+                'DELETE FROM cache WHERE key IN (%s)'
+                % ', '.join('?' * len(made)), made,
+            )
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def _cull(self, db, now):
+        size, entries = db.execute(
+            'SELECT size, entries FROM cache_stats'
+        ).fetchone()
+        if size <= self._max_size and entries <= self._max_entries:
+            return
+        db.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        size, entries = db.execute(
+            'SELECT size, entries FROM cache_stats'
+        ).fetchone()
+        # Освобождаем с запасом в долю 1/CULL_FREQUENCY, чтобы не
+        # чистить кэш при каждой следующей записи.
+        reserve = 1 - 1 / self._cull_frequency if self._cull_frequency else 0
+        excess_size = size - int(self._max_size * reserve)
+        excess_entries = entries - int(self._max_entries * reserve)
+        if excess_size <= 0 and excess_entries <= 0:
+            return
+        keys, freed = [], 0
+        for key, item_size in db.execute(
+                'SELECT key, size FROM cache ORDER BY accessed'):
+            if freed >= excess_size and len(keys) >= excess_entries:
+                break
+            keys.append(key)
+            freed += item_size
+        db.executemany('DELETE FROM cache WHERE key = ?',
+                       [(key,) for key in keys])
+
+    def close(self, **kwargs):
+        # Соединение живет все время процесса, как и у LocMemCache
+        # состояние: переоткрывать файл на каждый запрос дорого.
+        pass
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE: блокировка записи берется сразу, а не при
+    первой записи, поэтому чтение внутри транзакции не устаревает."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
@@ -0,0 +1,60 @@
+"""Хранилище файлов с адресацией по содержимому.
+
+Файл называется SHA-256 своего содержимого и раскладывается по двум
+уровням подкаталогов: posts/ab/cd/abcd...ef.webp. В каталоге не
+копятся миллионы файлов, а одинаковые загрузки хранятся один раз.
+
+Файл может использоваться несколькими записями, поэтому удалять его
+при удалении записи нельзя: неиспользуемые файлы убирает gc_media.
+Повторная загрузка того же файла обновляет его дату изменения, чтобы
+gc_media не удалил его как старый.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME = re.compile(
+    r'(?:.*/)?([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}(?:\.\w+)?$'
+)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def content_name(self, name, content):
+        """Имя файла по хэшу содержимого в каталоге исходного имени."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return '/'.join(filter(None, (
+            directory, hexdigest[:2], hexdigest[2:4], hexdigest + extension
+        )))
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        if self.exists(name):
+            try:
+                # Файл мог остаться от удаленного поста: свежая дата не
+                # даст gc_media удалить его, пока новая запись не
+                # сохранилась (--min-age)
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # gc_media удалил его только что: записываем заново
+                pass
+        saved = super()._save(name, content)
+        if saved != name:
+            # Тот же файл одновременно записал другой процесс, и
+            # FileSystemStorage сохранил копию под другим именем.
+            self.delete(saved)
+        return name
+
+    @staticmethod
+    def is_content_name(name):
+        return bool(HASHED_NAME.match(name))
@@ -0,0 +1,53 @@
+"""Фоновые задачи в пуле потоков процесса.
+
+Задача ставится в очередь после фиксации текущей транзакции и
+выполняется в одном из BACKGROUND_WORKERS потоков, не задерживая
+ответ. Внешней очереди нет: задачи, не успевшие выполниться до
+остановки процесса, теряются, поэтому они должны быть идемпотентны
+и восстановимы повторным запуском.
+
+BACKGROUND_TASKS_EAGER = True выполняет задачу сразу в вызывающем
+потоке (для тестов).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_WORKERS,
+                thread_name_prefix='background'
+            )
+    return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась с ошибкой',
+                         func.__qualname__)
+    finally:
+        close_old_connections()
+
+
+def submit(func, *args, **kwargs):
+    """Выполняет func(*args, **kwargs) в фоне после фиксации транзакции."""
+    if settings.BACKGROUND_TASKS_EAGER:
+        func(*args, **kwargs)
+        return
+    transaction.on_commit(
+        lambda: _get_executor().submit(_run, func, args, kwargs)
+    )
@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from core.fragments import placeholder
+
+register = template.Library()
+
+
+@register.simple_tag
+def personal(name, **kwargs):
+    """Метка персонального фрагмента, см. core.fragments."""
+    return mark_safe(placeholder(name, **kwargs))
@@ -0,0 +1,460 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+
+from . import metrics, slow_queries
+from .cache import LOCK_PREFIX, bump, get_generations, single_flight
+from .sqlite_cache import SQLiteCache
+from .tasks import _run
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class SingleFlightCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def produce(self, value='fresh'):
+        self.calls += 1
+        return value, True
+
+    def test_fresh_value_is_not_regenerated(self):
+        """Свежее значение отдается без пересборки."""
+        single_flight('key', self.produce, 60)
+        self.assertEqual(single_flight('key', self.produce, 60), 'fresh')
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_served_while_other_worker_regenerates(self):
+        """Пока другой процесс держит блокировку, отдается старое."""
+        cache.set('key', (time.time() - 1, 'stale'), 60)
+        cache.add(LOCK_PREFIX + 'key', 1)
+        self.assertEqual(single_flight('key', self.produce, 60), 'stale')
+        self.assertEqual(self.calls, 0)
+
+    def test_stale_value_regenerated_by_lock_owner(self):
+        """Устаревшее значение пересобирает процесс с блокировкой."""
+        cache.set('key', (time.time() - 1, 'stale'), 60)
+        self.assertEqual(single_flight('key', self.produce, 60), 'fresh')
+        self.assertEqual(self.calls, 1)
+        self.assertNotIn(LOCK_PREFIX + 'key', cache)
+
+    def test_outdated_value_is_regenerated(self):
+        """Значение, которое не прошло проверку, собирается заново."""
+        cache.set('key', (time.time() + 60, 'outdated'), 60)
+        value = single_flight(
+            'key', self.produce, 60, is_current=lambda value: False
+        )
+        self.assertEqual(value, 'fresh')
+        self.assertEqual(self.calls, 1)
+
+    def test_concurrent_miss_waits_for_lock_owner(self):
+        """Одновременный промах дожидается чужой пересборки."""
+        cache.add(LOCK_PREFIX + 'key', 1)
+        owner = threading.Timer(
+            0.1, cache.set, ('key', (time.time() + 60, 'shared'), 60)
+        )
+        owner.start()
+        self.assertEqual(single_flight('key', self.produce, 60), 'shared')
+        owner.join()
+        self.assertEqual(self.calls, 0)
+
+
+class GenerationTests(TestCase):
+    def test_bump_changes_only_its_scope(self):
+        """Сброс области меняет только ее поколение."""
+        before = get_generations(['posts', 'group:cats'])
+        bump('posts')
+        after = get_generations(['posts', 'group:cats'])
+        self.assertNotEqual(before[0], after[0])
+        self.assertEqual(before[1], after[1])
+
+
+class SQLiteCacheTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.path, {'OPTIONS': options})
+
+    def test_values_expire(self):
+        """Значения читаются до истечения таймаута."""
+        self.cache.set('alive', {'a': 1}, 60)
+        self.cache.set('dead', 1, -1)
+        self.assertEqual(self.cache.get('alive'), {'a': 1})
+        self.assertIsNone(self.cache.get('dead'))
+        self.assertTrue(self.cache.add('dead', 2))
+        self.assertFalse(self.cache.add('alive', 2))
+        self.assertEqual(
+            self.cache.get_many(['alive', 'dead', 'missing']),
+            {'alive': {'a': 1}, 'dead': 2},
+        )
+
+    def test_changes_are_visible_to_other_processes(self):
+        """Запись и удаление сразу видны другому экземпляру."""
+        other = self.make_cache()
+        self.cache.set('key', 'value')
+        self.assertEqual(other.get('key'), 'value')
+        other.delete('key')
+        self.assertNotIn('key', self.cache)
+
+    def test_concurrent_incr_is_atomic(self):
+        """Одновременные incr из разных соединений не теряются."""
+        self.cache.set('counter', 0)
+
+        def work():
+            cache = self.make_cache()
+            for _ in range(50):
+                cache.incr('counter')
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+
+    def test_least_recently_used_are_evicted(self):
+        """При превышении размера вытесняются давно не читавшиеся."""
+        cache = self.make_cache(MAX_SIZE=5000, CULL_FREQUENCY=10)
+        cache.ACCESS_RESOLUTION = 0
+        cache.set('kept', 'x' * 1000)
+        cache.set('evicted', 'x' * 1000)
+        cache.get('kept')
+        for i in range(3):
+            cache.set(f'new-{i}', 'x' * 1000)
+        self.assertIn('kept', cache)
+        self.assertNotIn('evicted', cache)
+        size, = cache._db.execute('SELECT size FROM cache_stats').fetchone()
+        self.assertLessEqual(size, 5000)
+
+
+class BackgroundTaskTests(TestCase):
+    def test_failed_task_is_logged(self):
+        """Ошибка фоновой задачи пишется в лог и не роняет поток."""
+        def fail():
+            raise RuntimeError('boom')
+
+        with self.assertLogs('core.tasks', 'ERROR'):
+            _run(fail, (), {})
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaViewTests(TestCase):
+    content = bytes(range(100))
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'posts'), exist_ok=True)
+        path = os.path.join(TEMP_MEDIA_ROOT, 'posts', 'a.gif')
+        with open(path, 'wb') as file:
+            file.write(cls.content)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def get(self, **headers):
+        return self.client.get('/media/posts/a.gif', **headers)
+
+    def test_file_served_with_cache_headers(self):
+        """Файл отдается целиком с валидаторами и immutable."""
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+
+    def test_conditional_get(self):
+        """По If-None-Match и If-Modified-Since отдается 304."""
+        response = self.get()
+        self.assertEqual(
+            self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304
+        )
+        self.assertEqual(self.get(
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        ).status_code, 304)
+        self.assertEqual(
+            self.get(HTTP_IF_NONE_MATCH='"other"').status_code, 200
+        )
+
+    def test_range(self):
+        """Range отдает часть файла, неверный диапазон — 416."""
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[10:20])
+        response = self.get(HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[-5:])
+        response = self.get(HTTP_RANGE='bytes=200-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_if_range_mismatch_serves_whole_file(self):
+        """Range со старым If-Range отдает файл целиком."""
+        response = self.get(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.get(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+    def test_missing_and_outside_files(self):
+        """Нет файла или путь вне MEDIA_ROOT — 404."""
+        self.assertEqual(
+            self.client.get('/media/posts/none.gif').status_code, 404
+        )
+        self.assertEqual(self.client.get('/media/posts').status_code, 404)
+        self.assertEqual(
+            self.client.get('/media/../settings.py').status_code, 404
+        )
+
+    @override_settings(MEDIA_SENDFILE_HEADER='X-Accel-Redirect')
+    def test_accel_redirect(self):
+        """С X-Accel-Redirect файл отдает фронтовой сервер."""
+        response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-media/posts/a.gif')
+        self.assertEqual(response.content, b'')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    @override_settings(MEDIA_SENDFILE_HEADER='X-Sendfile')
+    def test_sendfile(self):
+        """С X-Sendfile фронтовой сервер получает путь к файлу."""
+        response = self.get()
+        self.assertEqual(
+            response['X-Sendfile'],
+            os.path.join(TEMP_MEDIA_ROOT, 'posts', 'a.gif')
+        )
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_requests_labelled_by_url_name(self):
+        """Ответы, SQL и кэш считаются по имени URL."""
+        self.client.get('/')
+        self.client.get('/')
+        text = self.scrape()
+        self.assertIn('yatube_requests_total{view="posts:posts",'
+                      'method="GET",status="200"} 2', text)
+        self.assertIn('yatube_cache_requests_total{view="posts:posts",'
+                      'cache="page",result="miss"} 1', text)
+        self.assertIn('yatube_cache_requests_total{view="posts:posts",'
+                      'cache="page",result="hit"} 1', text)
+        self.assertIn('yatube_request_duration_seconds_count'
+                      '{view="posts:posts"} 2', text)
+        self.assertIn('yatube_request_db_queries_bucket'
+                      '{view="posts:posts",le="+Inf"} 2', text)
+        self.assertIn('yatube_response_size_bytes_count'
+                      '{view="posts:posts"} 2', text)
+
+    def test_unknown_paths_share_one_label(self):
+        """Адреса, которых нет в URLconf, не плодят новые ряды."""
+        self.client.get('/no-such-page/')
+        self.client.get('/another/missing/page/')
+        self.assertIn('yatube_requests_total{view="unresolved",'
+                      'method="GET",status="404"} 2', self.scrape())
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Корзины гистограммы накопительные, le включительно."""
+        registry = metrics.Registry()
+        labels = (('view', 'x'),)
+        for value in (0, 1, 1, 3, 500):
+            registry.observe('yatube_request_db_queries', labels, value)
+        text = metrics.render(*metrics.merge([registry.snapshot()]))
+        self.assertIn('yatube_request_db_queries_bucket'
+                      '{view="x",le="1.0"} 3', text)
+        self.assertIn('yatube_request_db_queries_bucket'
+                      '{view="x",le="5.0"} 4', text)
+        self.assertIn('yatube_request_db_queries_bucket'
+                      '{view="x",le="+Inf"} 5', text)
+        self.assertIn('yatube_request_db_queries_sum{view="x"} 505', text)
+
+    def test_snapshots_of_other_workers_are_summed(self):
+        """/metrics складывает снимки других процессов из METRICS_DIR."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        labels = [['view', 'posts:posts'], ['method', 'GET'],
+                  ['status', '200']]
+        with open(os.path.join(directory, '1.json'), 'w') as file:
+            json.dump({
+                'counters': [['yatube_requests_total', labels, 5]],
+                'histograms': [],
+            }, file)
+        with override_settings(METRICS_DIR=directory):
+            self.client.get('/')
+            text = self.scrape()
+            self.assertTrue(os.path.exists(
+                os.path.join(directory, f'{os.getpid()}.json')
+            ))
+        self.assertIn('yatube_requests_total{view="posts:posts",'
+                      'method="GET",status="200"} 6', text)
+
+    def test_hidden_from_other_addresses(self):
+        """С адресов не из METRICS_ALLOWED_IPS метрик не видно."""
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD=0, SLOW_QUERY_SAMPLE_RATE=1,
+                   SLOW_QUERY_MAX_PER_MINUTE=1000)
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(
+            slow_queries, 'limiter', slow_queries.RateLimiter()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def entries(self, logs):
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_entry_has_view_and_call_site(self):
+        """Запись содержит SQL, view и стек до строки views.py."""
+        with self.assertLogs('core.slow_queries') as logs:
+            self.client.get('/')
+        entries = self.entries(logs)
+        posts = [entry for entry in entries
+                 if 'FROM "posts_post"' in entry['sql']]
+        self.assertTrue(posts)
+        self.assertEqual(posts[0]['view'], 'posts:posts')
+        self.assertEqual(posts[0]['path'], '/')
+        stack = ' '.join(posts[0]['stack'])
+        self.assertIn('posts/views.py', stack)
+        self.assertNotIn('slow_queries', stack)
+
+    def test_template_call_site(self):
+        """Запрос из шаблона указывает на узел шаблона."""
+        template = Template('{% for user in users %}{% endfor %}')
+        wrapper = slow_queries.SlowQueryLog()
+        with self.assertLogs('core.slow_queries') as logs, \
+                connection.execute_wrapper(wrapper):
+            template.render(Context(
+                {'users': get_user_model().objects.all()}
+            ))
+        entry = self.entries(logs)[0]
+        self.assertIn('{% for user in users %}', entry['template'])
+        self.assertIn('core/tests.py', entry['stack'][0])
+
+    @override_settings(SLOW_QUERY_SAMPLE_RATE=0)
+    def test_sampling(self):
+        """При нулевой доле выборки журнал пуст."""
+        with self.assertNoLogs('core.slow_queries'):
+            self.client.get('/')
+
+    @override_settings(SLOW_QUERY_THRESHOLD=None)
+    def test_disabled(self):
+        with self.assertNoLogs('core.slow_queries'):
+            self.client.get('/')
+
+    def test_rate_limit_reports_dropped(self):
+        """Лимит отбрасывает записи, следующая сообщает, сколько."""
+        limiter = slow_queries.RateLimiter()
+        self.assertEqual(limiter.allow(2), 0)
+        self.assertEqual(limiter.allow(2), 0)
+        self.assertIsNone(limiter.allow(2))
+        self.assertIsNone(limiter.allow(2))
+        limiter.updated -= 30
+        self.assertEqual(limiter.allow(2), 2)
+
+    def test_fingerprint_ignores_values(self):
+        """Запросы, различающиеся значениями, имеют один отпечаток."""
+        self.assertEqual(
+            slow_queries.fingerprint(
+                'SELECT * FROM t WHERE id IN (%s, %s) AND name = \'x\' '
+                'LIMIT 21'
+            ),
+            slow_queries.fingerprint(
+                'SELECT *  FROM t WHERE id IN (%s) AND name = \'it\'\'s\' '
+                'LIMIT 5'
+            ),
+        )
+        self.assertNotEqual(slow_queries.fingerprint('SELECT a FROM t'),
+                            slow_queries.fingerprint('SELECT b FROM t'))
+
+    def test_report_command(self):
+        """Отчет сортирует отпечатки по суммарному времени."""
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        lines = [
+            {'duration_ms': 100, 'sql': 'SELECT a FROM t WHERE id = %s',
+             'view': 'posts:posts',
+             'stack': ['posts/utils.py:5 in f', 'posts/views.py:20 in x'],
+             'template': None},
+            {'duration_ms': 300, 'sql': 'SELECT a FROM t WHERE id = 7',
+             'view': 'posts:posts',
+             'stack': ['posts/utils.py:5 in f', 'posts/views.py:20 in x'],
+             'template': None},
+            {'duration_ms': 250, 'sql': 'SELECT b FROM t',
+             'view': 'posts:profile', 'stack': ['posts/views.py:50 in y'],
+             'template': 'posts/profile.html:3 {{ author.x }}'},
+        ]
+        with os.fdopen(handle, 'w') as file:
+            for line in lines:
+                file.write(json.dumps(line) + '\n')
+            file.write('not json\n')
+        out = StringIO()
+        call_command('slow_query_report', path, top=1, stdout=out)
+        report = out.getvalue()
+        self.assertIn('записей 2, всего 400.0 мс', report)
+        self.assertIn(
+            'posts/utils.py:5 in f <- posts/views.py:20 in x (2)', report
+        )
+        self.assertIn('SELECT a FROM t WHERE id = ?', report)
+        self.assertNotIn('SELECT b', report)
+        self.assertIn('Пропущено нечитаемых строк: 1', report)
+
+    def test_report_reads_rotated_logs(self):
+        """Без путей читаются журнал и его копии от logrotate, и сжатые."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'slow_queries.log')
+        line = json.dumps({'duration_ms': 100, 'sql': 'SELECT 1'}) + '\n'
+        with open(path, 'w') as file:
+            file.write(line)
+        with open(path + '.1', 'w') as file:
+            file.write(line)
+        with gzip.open(path + '.2.gz', 'wt') as file:
+            file.write(line)
+        out = StringIO()
+        with override_settings(SLOW_QUERY_LOG=path):
+            call_command('slow_query_report', stdout=out)
+        self.assertIn('записей 3, всего 300.0 мс', out.getvalue())
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Post, Group, Follow
+from .search import match_expression, matching
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -10,6 +11,12 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Ищет по индексу FTS5 вместо LIKE по всей таблице."""
+        if not match_expression(search_term):
+            return queryset, False
+        return queryset.filter(matching(search_term)), False
+
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
@@ -0,0 +1,22 @@
+"""Бюджеты SQL-запросов view постов.
+
+Имя URL из posts/urls.py -> сколько запросов view может выполнить
+при пустом кэше. Бюджет не зависит от размера страницы: если число
+запросов растет с числом постов или комментариев, это N+1, и
+posts.tests.test_budgets это поймает. В бюджет входят запросы
+сессии и пользователя для авторизованных запросов.
+"""
+QUERY_BUDGETS = {
+    'posts': 2,
+    'group_posts': 3,
+    'profile': 7,
+    'post_detail': 4,
+    'comments': 2,
+    'add_comment': 7,
+    'post_create': 13,
+    'post_edit': 8,
+    'follow_index': 8,
+    'search': 2,
+    'profile_follow': 19,
+    'profile_unfollow': 15,
+}
@@ -0,0 +1,42 @@
+"""Кэш отрендеренных карточек постов.
+
+Карточка зависит только от поста и шаблона, поэтому ключ состоит из
+id поста, его версии (updated_at) и имени шаблона. Правка поста
+меняет updated_at, а смена группы обновляет updated_at ее постов
+(posts.signals), так что старые карточки просто перестают находиться.
+Страница ленты достает все карточки одним get_many и рендерит только
+промахи, а миниатюры для них ищет тоже одним запросом.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+
+from core.metrics import cache_access
+
+from . import thumbnails
+
+PREFIX = 'card:'
+
+
+def card_key(post, template_name):
+    version = int(post.updated_at.timestamp() * 1_000_000)
+    return f'{PREFIX}{template_name}:{post.pk}:{version}'
+
+
+def render_cards(posts, template_name):
+    """HTML карточек постов в порядке posts."""
+    posts = list(posts)
+    keys = [card_key(post, template_name) for post in posts]
+    cards = cache.get_many(keys)
+    missed = {
+        key: post for key, post in zip(keys, posts) if key not in cards
+    }
+    cache_access('card', 'hit', len(cards))
+    cache_access('card', 'miss', len(missed))
+    thumbnails.attach(missed.values())
+    template = get_template(template_name)
+    for key, post in missed.items():
+        cards[key] = missed[key] = template.render({'post': post})
+    if missed:
+        cache.set_many(missed, settings.POST_CARD_TIMEOUT)
+    return [cards[key] for key in keys]
@@ -0,0 +1,110 @@
+"""Денормализованные счетчики постов, подписок и комментариев."""
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Comment, Follow, Post, UserCounter
+
+FIELDS = ('posts_count', 'followers_count', 'following_count')
+
+
+def get_counter(user):
+    """Счетчики пользователя без агрегатных запросов.
+
+    Чтобы не было лишнего запроса, выбирайте пользователя
+    с select_related('counter').
+    """
+    return getattr(user, 'counter', None) or UserCounter(user=user)
+
+
+def _shifted(field, delta):
+    """F-выражение поля, сдвинутого на delta, но не ниже нуля.
+
+    Счетчик мог уже разойтись с данными, а PositiveIntegerField не
+    примет отрицательное значение, и запись упадет.
+    """
+    if delta >= 0:
+        return F(field) + delta
+    return Greatest(F(field) + delta, 0)
+
+
+def change(user_id, **deltas):
+    """Атомарно сдвигает счетчики пользователя на заданные величины."""
+    values = {field: _shifted(field, delta) for field, delta in deltas.items()}
+    with transaction.atomic():
+        if UserCounter.objects.filter(user_id=user_id).update(**values):
+            return
+        if any(delta < 0 for delta in deltas.values()):
+            # Строки нет: пользователь удаляется или счетчики еще не
+            # сверены, уменьшать нечего.
+            return
+        UserCounter.objects.get_or_create(user_id=user_id)
+        UserCounter.objects.filter(user_id=user_id).update(**values)
+
+
+def change_comments(post_id, delta):
+    """Атомарно сдвигает счетчик комментариев поста."""
+    Post.objects.filter(pk=post_id).update(
+        comments_count=_shifted('comments_count', delta)
+    )
+
+
+def is_above(author_id, followers):
+    """Проверяет, что подписчиков у автора больше followers."""
+    return UserCounter.objects.filter(
+        user_id=author_id, followers_count__gt=followers
+    ).exists()
+
+
+def _grouped(queryset, field, ids):
+    return dict(
+        queryset.filter(**{f'{field}__in': ids})
+        .values_list(field)
+        .annotate(total=Count('pk'))
+        .order_by()
+    )
+
+
+def reconcile(user_ids):
+    """Пересчитывает счетчики пачки пользователей.
+
+    Возвращает число исправленных записей.
+    """
+    actual = {
+        'posts_count': _grouped(Post.objects, 'author', user_ids),
+        'followers_count': _grouped(Follow.objects, 'author', user_ids),
+        'following_count': _grouped(Follow.objects, 'user', user_ids),
+    }
+    stored = UserCounter.objects.in_bulk(user_ids)
+    to_create, to_update = [], []
+    for user_id in user_ids:
+        values = {
+            field: actual[field].get(user_id, 0) for field in FIELDS
+        }
+        counter = stored.get(user_id)
+        if counter is None:
+            to_create.append(UserCounter(user_id=user_id, **values))
+        elif any(getattr(counter, f) != v for f, v in values.items()):
+            for field, value in values.items():
+                setattr(counter, field, value)
+            to_update.append(counter)
+    with transaction.atomic():
+        UserCounter.objects.bulk_create(to_create, ignore_conflicts=True)
+        UserCounter.objects.bulk_update(to_update, FIELDS)
+    return len(to_create) + len(to_update)
+
+
+def reconcile_comments(post_ids):
+    """Пересчитывает счетчик комментариев пачки постов.
+
+    Возвращает число исправленных записей.
+    """
+    actual = _grouped(Comment.objects, 'post', post_ids)
+    to_update = []
+    for post in Post.objects.filter(pk__in=post_ids).only('comments_count'):
+        total = actual.get(post.pk, 0)
+        if post.comments_count != total:
+            post.comments_count = total
+            to_update.append(post)
+    Post.objects.bulk_update(to_update, ['comments_count'])
+    return len(to_update)
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from .images import normalize
 from .models import Post, Comment
 
 
@@ -9,6 +11,18 @@ class PostForm(forms.ModelForm):
         fields = ['text', 'group', 'image']
         labels = {'text': 'Текст', 'group': 'Группа', 'image': 'Картинка'}
 
+    def clean_image(self):
+        """Новая картинка уменьшается и сохраняется в WebP.
+
+        Заглушка считается здесь, пока картинка уже открыта.
+        """
+        image = self.cleaned_data['image']
+        if isinstance(image, UploadedFile):
+            image, self.instance.image_placeholder = normalize(image)
+        elif not image:
+            self.instance.image_placeholder = ''
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
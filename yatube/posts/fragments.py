@@ -0,0 +1,37 @@
+"""Персональные фрагменты страниц posts (см. core.fragments)."""
+from core.fragments import register
+
+from .forms import CommentForm
+from .models import Follow
+
+
+@register('switcher', 'posts/includes/switcher.html')
+def switcher(request):
+    return {}
+
+
+@register('following', 'includes/following.html')
+def following(request, username):
+    user = request.user
+    return {
+        'author': {'username': username},
+        'following': user.is_authenticated and Follow.objects.filter(
+            user=user, author__username=username
+        ).exists(),
+    }
+
+
+@register('post_edit_link', 'posts/includes/edit_link.html')
+def post_edit_link(request, post_id, author_id):
+    return {
+        'post_id': post_id,
+        'is_author': request.user.pk == author_id,
+    }
+
+
+@register('comment_form', 'includes/comment_form.html')
+def comment_form(request, post_id):
+    return {
+        'post': {'id': post_id},
+        'form': CommentForm(),
+    }
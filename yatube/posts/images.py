@@ -0,0 +1,78 @@
+"""Обработка загруженных картинок постов.
+
+Оригинал с камеры весит мегабайты и заново декодируется для каждой
+миниатюры. Поэтому при загрузке картинка поворачивается по EXIF,
+уменьшается до POST_IMAGE_MAX_SIDE по большей стороне и сохраняется
+в WebP без метаданных. Память ограничена: картинки больше
+POST_IMAGE_MAX_PIXELS отклоняются до декодирования, а JPEG
+декодируется сразу в уменьшенном масштабе (draft).
+
+Из той же картинки делается заглушка (LQIP): копия не больше
+PLACEHOLDER_SIDE точек по большей стороне в виде data URI на сотню-
+другую байт. Она хранится в Post.image_placeholder и видна, пока
+грузится настоящая картинка или еще не готовы миниатюры.
+"""
+import base64
+import io
+import os
+
+from django.conf import settings as s
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+FORMAT = 'WEBP'
+EXTENSION = '.webp'
+PLACEHOLDER_SIDE = 16
+PLACEHOLDER_QUALITY = 40
+
+
+def normalize(file):
+    """Готовит загруженную картинку к хранению.
+
+    Возвращает (ContentFile в WebP, заглушка).
+    """
+    file.seek(0)
+    try:
+        return _normalize(file)
+    except (OSError, SyntaxError) as error:
+        raise ValidationError(
+            'Не удалось обработать картинку.', code='invalid_image'
+        ) from error
+
+
+def _normalize(file):
+    with Image.open(file) as image:
+        if image.width * image.height > s.POST_IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                'Картинка слишком большая: не больше %(pixels)s пикселей.',
+                code='too_large',
+                params={'pixels': s.POST_IMAGE_MAX_PIXELS},
+            )
+        max_side = s.POST_IMAGE_MAX_SIDE
+        # JPEG декодируется сразу в масштабе 1/2..1/8, не меньше нужного
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        has_alpha = (image.mode in ('RGBA', 'LA', 'PA')
+                     or 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        buffer = io.BytesIO()
+        # Метаданные (EXIF, ICC, XMP) не передаются и не сохраняются
+        image.save(buffer, FORMAT, quality=s.POST_IMAGE_QUALITY, method=4)
+        lqip = placeholder(image)
+    name = os.path.splitext(os.path.basename(file.name))[0] + EXTENSION
+    return ContentFile(buffer.getvalue(), name=name), lqip
+
+
+def placeholder(image):
+    """Заглушка для открытой картинки PIL: крошечный WebP в data URI."""
+    small = ImageOps.contain(
+        image, (PLACEHOLDER_SIDE, PLACEHOLDER_SIDE), Image.BILINEAR
+    )
+    if small.mode not in ('RGB', 'RGBA'):
+        small = small.convert('RGB')
+    buffer = io.BytesIO()
+    small.save(buffer, FORMAT, quality=PLACEHOLDER_QUALITY)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/webp;base64,{encoded}'
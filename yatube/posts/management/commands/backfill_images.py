@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from posts.images import PLACEHOLDER_SIDE, placeholder
+from posts.models import Post
+from posts.signals import bump_post_scopes
+
+
+class Command(BaseCommand):
+    help = ('Заполняет заглушки (LQIP) картинок постов, загруженных до '
+            'их появления.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help='Сколько постов обрабатывать за один проход.'
+        )
+
+    def fill_batch(self, posts):
+        """Читает картинки пачки и возвращает заполненные посты."""
+        filled = []
+        now = timezone.now()
+        for post in posts:
+            try:
+                with post.image.open() as file, Image.open(file) as image:
+                    image.draft('RGB', (PLACEHOLDER_SIDE, PLACEHOLDER_SIDE))
+                    post.image_placeholder = placeholder(
+                        ImageOps.exif_transpose(image)
+                    )
+            except (OSError, SyntaxError) as error:
+                self.stderr.write(f'Пост {post.pk}: {error}')
+                continue
+            post.updated_at = now
+            filled.append(post)
+        Post.objects.bulk_update(filled, ['image_placeholder', 'updated_at'])
+        return filled
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk, checked, total_filled = 0, 0, 0
+        while True:
+            posts = list(
+                Post.objects.filter(pk__gt=last_pk).exclude(image='')
+                .filter(image_placeholder='')
+                .select_related('author').order_by('pk')[:batch_size]
+            )
+            if not posts:
+                break
+            last_pk = posts[-1].pk
+            for post in self.fill_batch(posts):
+                bump_post_scopes(post)
+                total_filled += 1
+            checked += len(posts)
+            self.stdout.write(f'Проверено {checked}, заполнено {total_filled}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: заполнено {total_filled} постов'
+        ))
@@ -0,0 +1,302 @@
+import gc
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from posts.models import Follow, Post, UserCounter
+
+PERCENTILES = (50, 95, 99)
+# p99 из десятков замеров — почти всегда выброс (сборка мусора,
+# планировщик ОС), поэтому он выводится, но регрессией не считается
+CHECKED = ('p50', 'p95', 'bytes')
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число запросов и размер ответа view постов '
+            'и сравнивает их с сохраненным JSON. Запускайте на базе, '
+            'заполненной generate_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=50,
+            help='Сколько замеров на каждый view.'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=3,
+            help='Сколько запросов сделать до замеров.'
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом.'
+        )
+        parser.add_argument(
+            '--baseline',
+            default=os.path.join(settings.BASE_DIR, 'benchmarks.json'),
+            help='JSON с прошлыми результатами. Они зависят от машины и '
+                 'данных, поэтому в репозиторий не попадают.'
+        )
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Записать результаты как новые базовые.'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Допустимый рост задержки и размера ответа (0.25 — 25%%). '
+                 'Число запросов расти не может.'
+        )
+        parser.add_argument(
+            '--min-delta', type=float, default=3.0,
+            help='Рост задержки меньше стольких миллисекунд не считается '
+                 'регрессией: на быстрых view это шум.'
+        )
+        parser.add_argument(
+            '--views', nargs='+',
+            help='Замерить только эти view.'
+        )
+
+    def cases(self):
+        """Замеряемые запросы: имя -> (метод, адрес, данные, клиент).
+
+        Для замеров берутся самые нагруженные объекты: автор с
+        наибольшим числом подписчиков, самый обсуждаемый пост и
+        пользователь с наибольшим числом подписок. Подписка и отписка
+        замеряются на самом популярном авторе, на которого этот
+        пользователь не подписан: перед каждым замером подписка
+        удаляется или создается, чтобы view действительно писал в базу.
+        """
+        author = UserCounter.objects.select_related('user').order_by(
+            '-followers_count'
+        ).first()
+        reader = UserCounter.objects.select_related('user').order_by(
+            '-following_count'
+        ).first()
+        post = Post.objects.select_related('author').order_by(
+            '-comments_count'
+        ).first()
+        grouped = Post.objects.exclude(group=None).select_related(
+            'group'
+        ).order_by('-pub_date').first()
+        if not (author and reader and post and grouped):
+            raise CommandError('База пуста: сначала запустите generate_data.')
+        author, reader = author.user, reader.user
+        target = UserCounter.objects.select_related('user').exclude(
+            user=reader
+        ).exclude(user__following__user=reader).order_by(
+            '-followers_count'
+        ).first()
+        if target is None:
+            raise CommandError('Пользователь с наибольшим числом подписок '
+                               'подписан на всех.')
+        target = target.user
+        follows = Follow.objects.filter(user=reader, author=target)
+
+        def unfollowed():
+            follows.delete()
+
+        def followed():
+            Follow.objects.get_or_create(user=reader, author=target)
+
+        anonymous, reader_client, author_client = Client(), Client(), Client()
+        reader_client.force_login(reader)
+        author_client.force_login(post.author)
+        username = author.username
+        return {
+            'index': ('get', reverse('posts:posts'), None, anonymous),
+            'group_posts': (
+                'get', reverse('posts:group_posts', args=[grouped.group.slug]),
+                None, anonymous
+            ),
+            'profile': (
+                'get', reverse('posts:profile', args=[username]), None,
+                anonymous
+            ),
+            'post_detail': (
+                'get', reverse('posts:post_detail', args=[post.pk]), None,
+                anonymous
+            ),
+            'follow_index': (
+                'get', reverse('posts:follow_index'), None, reader_client
+            ),
+            'post_create': (
+                'post', reverse('posts:post_create'),
+                {'text': 'Замер'}, reader_client
+            ),
+            'post_edit': (
+                'post', reverse('posts:post_edit', args=[post.pk]),
+                {'text': post.text}, author_client
+            ),
+            'add_comment': (
+                'post', reverse('posts:add_comment', args=[post.pk]),
+                {'text': 'Замер'}, reader_client
+            ),
+            'profile_follow': (
+                'get',
+                reverse('posts:profile_follow', args=[target.username]),
+                None, reader_client, unfollowed
+            ),
+            'profile_unfollow': (
+                'get',
+                reverse('posts:profile_unfollow', args=[target.username]),
+                None, reader_client, followed
+            ),
+        }
+
+    def request(self, method, url, data, client, prepare=None):
+        """Один запрос: (секунды, число запросов к БД, байты ответа).
+
+        Изменения пишущих view откатываются, чтобы замеры не меняли
+        данные. prepare() готовит данные в той же транзакции и в
+        замер не входит.
+        """
+        if self.cold:
+            cache.clear()
+        with transaction.atomic():
+            if prepare is not None:
+                prepare()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        if response.status_code >= 400:
+            raise CommandError(f'{method.upper()} {url}: '
+                               f'ответ {response.status_code}')
+        return elapsed, len(queries), len(response.content)
+
+    def measure(self, case):
+        gc.collect()
+        for _ in range(self.warmup):
+            self.request(*case)
+        timings, query_counts, sizes = [], [], []
+        for _ in range(self.iterations):
+            elapsed, query_count, size = self.request(*case)
+            timings.append(elapsed * 1000)
+            query_counts.append(query_count)
+            sizes.append(size)
+        result = {
+            f'p{percent}': round(percentile(timings, percent), 3)
+            for percent in PERCENTILES
+        }
+        result['queries'] = max(query_counts)
+        result['bytes'] = max(sizes)
+        return result
+
+    def regressions(self, name, result, baseline):
+        """Описания метрик view, которые вышли за допуск."""
+        found = []
+        limit = 1 + self.tolerance
+        for metric in CHECKED:
+            if metric not in baseline:
+                continue
+            slack = 0 if metric == 'bytes' else self.min_delta
+            if result[metric] > max(baseline[metric] * limit,
+                                    baseline[metric] + slack):
+                found.append(f'{name}: {metric} {result[metric]} > '
+                             f'{baseline[metric]} * {limit:g}')
+        if 'queries' in baseline and result['queries'] > baseline['queries']:
+            found.append(f'{name}: запросов {result["queries"]} > '
+                         f'{baseline["queries"]}')
+        return found
+
+    def isolated_caches(self, directory):
+        """CACHES, где default — отдельная копия кэша сайта.
+
+        Откат транзакции не возвращает сброшенные поколения (core.cache)
+        и очистку кэша при --cold, поэтому замеры идут на том же бэкенде,
+        но в своем месте, а рабочий кэш страниц остается нетронутым.
+        """
+        config = dict(settings.CACHES['default'])
+        backend = config['BACKEND']
+        if backend.endswith('LocMemCache'):
+            config['LOCATION'] = 'benchmark_views'
+        elif backend.endswith(('SQLiteCache', 'FileBasedCache')):
+            config['LOCATION'] = os.path.join(directory, 'cache')
+        elif self.cold:
+            raise CommandError('--cold очистил бы общий сервер кэша сайта.')
+        else:
+            # Общий сервер кэша: ключи замеров отделяются префиксом
+            config['KEY_PREFIX'] = f'benchmark_views:{os.getpid()}'
+        return {**settings.CACHES, 'default': config}
+
+    def run(self, names, baseline):
+        """Замеряет view; возвращает результаты и найденные регрессии."""
+        cases = self.cases()
+        names = names or list(cases)
+        unknown = set(names) - set(cases)
+        if unknown:
+            raise CommandError(f'Неизвестные view: {", ".join(unknown)}')
+        results, regressions = {}, []
+        self.stdout.write(
+            f'{"view":<18}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"запросов":>10}{"байт":>10}'
+        )
+        for name in names:
+            result = results[name] = self.measure(cases[name])
+            self.stdout.write(
+                f'{name:<18}{result["p50"]:>9.2f}{result["p95"]:>9.2f}'
+                f'{result["p99"]:>9.2f}{result["queries"]:>10}'
+                f'{result["bytes"]:>10}'
+            )
+            regressions += self.regressions(
+                name, result, baseline.get(name, {})
+            )
+        return results, regressions
+
+    def handle(self, *args, **options):
+        self.iterations = options['iterations']
+        self.warmup = options['warmup']
+        self.cold = options['cold']
+        self.tolerance = options['tolerance']
+        self.min_delta = options['min_delta']
+        # Базовые результаты с кэшем и без хранятся отдельно
+        mode = 'cold' if self.cold else 'warm'
+        stored = {}
+        if os.path.exists(options['baseline']):
+            with open(options['baseline']) as file:
+                stored = json.load(file)
+        baseline = stored.get(mode, {})
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(ALLOWED_HOSTS=hosts,
+                                   CACHES=self.isolated_caches(directory)):
+                results, regressions = self.run(options['views'], baseline)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        if options['save']:
+            with open(options['baseline'], 'w') as file:
+                stored[mode] = {**baseline, **results}
+                json.dump(stored, file, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты записаны в {options["baseline"]}'
+            ))
+            return
+        if regressions:
+            raise CommandError('Регрессия:\n' + '\n'.join(regressions))
+        if baseline:
+            self.stdout.write(self.style.SUCCESS(
+                'Готово: регрессий нет'
+            ))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'Нет базовых результатов в {options["baseline"]}, '
+                'сохраните их через --save'
+            ))
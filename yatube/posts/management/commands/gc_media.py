@@ -0,0 +1,207 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts.models import Post
+
+
+def walk(storage, directory):
+    """Файлы каталога хранилища по одному, без списка всего дерева."""
+    try:
+        entries = os.scandir(storage.path(directory))
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            name = f'{directory}/{entry.name}'
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(storage, name)
+            elif entry.is_file(follow_symlinks=False):
+                yield name, entry.stat()
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки, на которые не ссылается ни один пост, '
+            'их миниатюры и записи о них в хранилище ключей sorl.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько файлов или записей проверять одним запросом.'
+        )
+        parser.add_argument(
+            '--rate', type=float, default=50,
+            help='Не больше стольких удалений файлов в секунду (0 — без '
+                 'ограничения).'
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Не трогать файлы моложе стольких секунд: пост с только '
+                 'что загруженной картинкой мог еще не сохраниться.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено.'
+        )
+
+    def throttle(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_delete > now:
+            time.sleep(self.next_delete - now)
+        self.next_delete = max(self.next_delete, now) + self.interval
+
+    def delete_files(self, storage, files, is_referenced):
+        """Удаляет старые файлы из списка (имя, stat); возвращает байты.
+
+        Перед самым удалением дата и ссылки проверяются заново: пока
+        шла пачка, файл мог снова понадобиться новому посту.
+        """
+        freed = 0
+        for name, stat in files:
+            if stat.st_mtime > self.cutoff:
+                continue
+            if not self.dry_run:
+                self.throttle()
+                try:
+                    stat = os.stat(storage.path(name))
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime > self.cutoff or is_referenced(name):
+                    continue
+            if self.verbosity > 1:
+                self.stdout.write(f'Удаляется {name}')
+            if not self.dry_run:
+                storage.delete(name)
+            self.deleted += 1
+            freed += stat.st_size
+        return freed
+
+    def collect_images(self):
+        """Исходники в каталоге постов, которых нет в Post.image."""
+        field = Post._meta.get_field('image')
+        storage = field.storage
+        freed = 0
+        for batch in batches(walk(storage, field.upload_to.rstrip('/')),
+                             self.batch_size):
+            referenced = set(
+                Post.objects.filter(image__in=[name for name, _ in batch])
+                .values_list('image', flat=True)
+            )
+            freed += self.delete_files(
+                storage,
+                [(name, stat) for name, stat in batch
+                 if name not in referenced],
+                lambda name: Post.objects.filter(image=name).exists(),
+            )
+        return freed
+
+    def collect_kvstore(self):
+        """Записи sorl об исходниках без постов и об их миниатюрах.
+
+        Файлы миниатюр после этого остаются без записей и удаляются
+        в collect_thumbnails. При --dry-run записи не удаляются, а
+        запоминаются в self.dropped_keys, чтобы отчет о миниатюрах
+        совпал с настоящим запуском.
+        """
+        prefix = add_prefix('')
+        thumbnails_prefix = add_prefix('', identity='thumbnails')
+        last_key, removed = add_prefix(''), 0
+        while True:
+            rows = list(
+                KVStore.objects
+                .filter(key__gt=last_key, key__startswith=prefix)
+                .order_by('key').values_list('key', 'value')[:self.batch_size]
+            )
+            if not rows:
+                return removed
+            last_key = rows[-1][0]
+            sources = {}
+            for key, value in rows:
+                name = deserialize_image_file(value).name
+                if not name.startswith(sorl_settings.THUMBNAIL_PREFIX):
+                    sources[name] = key[len(prefix):]
+            referenced = set(
+                Post.objects.filter(image__in=list(sources))
+                .values_list('image', flat=True)
+            )
+            orphans = [
+                source_key for name, source_key in sources.items()
+                if name not in referenced
+            ]
+            keys = [prefix + key for key in orphans]
+            keys += [thumbnails_prefix + key for key in orphans]
+            for value in KVStore.objects.filter(
+                key__in=[thumbnails_prefix + key for key in orphans]
+            ).values_list('value', flat=True):
+                keys += [prefix + key for key in json.loads(value)]
+            if self.dry_run:
+                self.dropped_keys.update(keys)
+            elif keys:
+                KVStore.objects.filter(key__in=keys).delete()
+                default.kvstore.cache.delete_many(keys)
+            removed += len(keys)
+
+    def collect_thumbnails(self):
+        """Файлы миниатюр, о которых не знает хранилище ключей sorl."""
+        storage = default.storage
+        freed = 0
+        directory = sorl_settings.THUMBNAIL_PREFIX.rstrip('/')
+        for batch in batches(walk(storage, directory), self.batch_size):
+            keys = {
+                add_prefix(ImageFile(name, storage).key): (name, stat)
+                for name, stat in batch
+            }
+            known = set(
+                KVStore.objects.filter(key__in=list(keys))
+                .values_list('key', flat=True)
+            ) - self.dropped_keys
+            freed += self.delete_files(
+                storage,
+                [file for key, file in keys.items() if key not in known],
+                lambda name: KVStore.objects.filter(
+                    key=add_prefix(ImageFile(name, storage).key)
+                ).exists(),
+            )
+        return freed
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.interval = 1 / options['rate'] if options['rate'] else 0
+        self.next_delete = time.monotonic()
+        self.cutoff = time.time() - options['min_age']
+        self.deleted = 0
+        self.dropped_keys = set()
+
+        images_freed = self.collect_images()
+        self.stdout.write(f'Исходники: {images_freed} байт')
+        removed_keys = self.collect_kvstore()
+        self.stdout.write(f'Записи о миниатюрах: {removed_keys}')
+        thumbnails_freed = self.collect_thumbnails()
+        self.stdout.write(f'Миниатюры: {thumbnails_freed} байт')
+
+        verb = 'будет удалено' if self.dry_run else 'удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {verb} {self.deleted} файлов на '
+            f'{images_freed + thumbnails_freed} байт'
+        ))
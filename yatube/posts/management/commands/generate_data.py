@@ -0,0 +1,260 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+
+from posts.models import (Comment, Follow, Group, Post, TimelineEntry,
+                          UserCounter)
+
+User = get_user_model()
+PASSWORD = 'synthetic'
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def power_law(count, alpha):
+    """Накопленные веса Ципфа: k-й по популярности весит 1 / k^alpha."""
+    return list(accumulate(rank ** -alpha for rank in range(1, count + 1)))
+
+
+@contextmanager
+def explicit_dates(model):
+    """Отключает auto_now и auto_now_add, чтобы даты не заменялись."""
+    fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False)
+        or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, группами, '
+            'постами, комментариями и подписками. Одинаковый --seed дает '
+            'одинаковые данные.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='Показатель степенного закона популярности авторов: '
+                 'чем больше, тем сильнее выделяются знаменитости.'
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней распределены посты.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Сколько записей вставлять одним bulk_create.'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Запустить при DEBUG = False.'
+        )
+
+    def insert(self, model, objects, total, label, **kwargs):
+        """Вставляет объекты пачками, по транзакции на пачку."""
+        done = 0
+        for chunk in chunks(objects, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(chunk, **kwargs)
+            done += len(chunk)
+            progress = f'{done}/{total}' if total is not None else done
+            self.stdout.write(f'{label}: {progress}')
+
+    def write(self, model, objects, total, label, **kwargs):
+        """Вставляет объекты пачками и возвращает id новых записей."""
+        after = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        self.insert(model, objects, total, label, **kwargs)
+        # SQLite не возвращает id из bulk_create, но выдает их по порядку
+        return list(
+            model.objects.filter(pk__gt=after).order_by('pk')
+            .values_list('pk', flat=True)
+        )
+
+    def users(self, count):
+        password = make_password(PASSWORD, salt=f'seed{self.seed}')
+        fake = self.fake
+        return (
+            User(
+                username=f'{fake.user_name()}_{self.seed}_{number}',
+                first_name=fake.first_name(),
+                last_name=fake.last_name(),
+                email=fake.email(),
+                password=password,
+            )
+            for number in range(count)
+        )
+
+    def groups(self, count):
+        fake = self.fake
+        return (
+            Group(
+                title=fake.sentence(nb_words=3).rstrip('.'),
+                slug=f'group-{self.seed}-{number}',
+                description=fake.paragraph(),
+            )
+            for number in range(count)
+        )
+
+    def post_date(self, number):
+        """Дата number-го поста: посты идут по времени равномерно."""
+        return self.start + self.span * number / self.post_count
+
+    def posts(self, count, user_ids, group_ids):
+        rng, fake = self.rng, self.fake
+        authors = user_ids[:]
+        rng.shuffle(authors)
+        weights = power_law(len(authors), self.alpha)
+        for number in range(count):
+            date = self.post_date(number)
+            group_id = None
+            if group_ids and rng.random() < 0.6:
+                group_id = rng.choice(group_ids)
+            yield Post(
+                author_id=rng.choices(authors, cum_weights=weights)[0],
+                group_id=group_id,
+                text=fake.paragraph(nb_sentences=rng.randint(1, 8)),
+                pub_date=date,
+                updated_at=date,
+            )
+
+    def comments(self, count, user_ids, post_ids):
+        rng, fake = self.rng, self.fake
+        if not post_ids:
+            return
+        for _ in range(count):
+            number = rng.randrange(len(post_ids))
+            yield Comment(
+                post_id=post_ids[number],
+                author_id=rng.choice(user_ids),
+                text=fake.sentence(),
+                pub_date=self.post_date(number)
+                + timedelta(minutes=rng.randint(1, 60 * 24 * 3)),
+            )
+
+    def follows(self, count, user_ids):
+        """Подписки: подписчик случайный, автор по степенному закону.
+
+        Повторные пары отбрасывает уникальный индекс при вставке.
+        """
+        rng = self.rng
+        authors = user_ids[:]
+        rng.shuffle(authors)
+        weights = power_law(len(authors), self.alpha)
+        for _ in range(count):
+            user_id = rng.choice(user_ids)
+            author_id = rng.choices(authors, cum_weights=weights)[0]
+            if user_id != author_id:
+                yield Follow(user_id=user_id, author_id=author_id)
+
+    def timeline_entries(self):
+        """Записи лент, которые сделал бы fan-out при публикации.
+
+        Посты знаменитостей лента подтягивает сама при чтении.
+        """
+        celebrities = UserCounter.objects.filter(
+            followers_count__gt=settings.TIMELINE_FANOUT_LIMIT
+        ).values_list('user_id', flat=True)
+        author_ids = list(
+            Follow.objects.exclude(author_id__in=celebrities)
+            .order_by('author_id').values_list('author_id', flat=True)
+            .distinct()
+        )
+        for author_id in author_ids:
+            latest = list(
+                Post.objects.filter(author_id=author_id)
+                .order_by('-pub_date', '-pk')
+                .values_list('pk', 'pub_date')[:settings.TIMELINE_BACKFILL]
+            )
+            follower_ids = list(Follow.objects.filter(
+                author_id=author_id
+            ).values_list('user_id', flat=True))
+            for user_id in follower_ids:
+                for pk, date in latest:
+                    yield TimelineEntry(
+                        user_id=user_id, post_id=pk, pub_date=date
+                    )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError(
+                'DEBUG выключен: похоже на рабочую базу. '
+                'Запустите с --force, если это не так.'
+            )
+        self.seed = options['seed']
+        self.alpha = options['alpha']
+        self.batch_size = options['batch_size']
+        self.rng = random.Random(self.seed)
+        self.fake = Faker('ru_RU')
+        self.fake.seed_instance(self.seed)
+        self.post_count = max(options['posts'], 1)
+        self.span = timedelta(days=options['days'])
+        today = timezone.now().replace(hour=0, minute=0, second=0,
+                                       microsecond=0)
+        self.start = today - self.span
+
+        user_ids = self.write(
+            User, self.users(options['users']), options['users'],
+            'Пользователи'
+        )
+        group_ids = self.write(
+            Group, self.groups(options['groups']), options['groups'],
+            'Группы'
+        )
+        with explicit_dates(Post):
+            post_ids = self.write(
+                Post, self.posts(options['posts'], user_ids, group_ids),
+                options['posts'], 'Посты'
+            )
+        with explicit_dates(Comment):
+            self.write(
+                Comment,
+                self.comments(options['comments'], user_ids, post_ids),
+                options['comments'], 'Комментарии'
+            )
+        self.write(
+            Follow, self.follows(options['follows'], user_ids),
+            options['follows'], 'Подписки', ignore_conflicts=True
+        )
+        call_command('reconcile_counters', batch_size=self.batch_size,
+                     stdout=self.stdout)
+        self.insert(TimelineEntry, self.timeline_entries(), None, 'Ленты',
+                    ignore_conflicts=True)
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: пользователей {len(user_ids)}, групп '
+            f'{len(group_ids)}, постов {len(post_ids)}. Пароль всех '
+            f'пользователей: {PASSWORD}'
+        ))
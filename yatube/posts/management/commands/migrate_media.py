@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts import thumbnails
+from posts.models import Post
+from posts.signals import bump_post_scopes
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов в хранилище по содержимому '
+            '(core.storage) пачками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько постов переносить за один проход.'
+        )
+        parser.add_argument(
+            '--keep-originals', action='store_true',
+            help='Не удалять старые файлы после переноса.'
+        )
+        parser.add_argument(
+            '--skip-thumbnails', action='store_true',
+            help='Не создавать миниатюры для новых имен файлов.'
+        )
+
+    def move_batch(self, posts):
+        """Копирует файлы пачки под новыми именами.
+
+        Возвращает перенесенные посты и старые имена файлов.
+        """
+        moved, old_names = [], set()
+        now = timezone.now()
+        for post in posts:
+            name = post.image.name
+            if self.storage.is_content_name(name):
+                continue
+            if not self.storage.exists(name):
+                self.stderr.write(f'Пост {post.pk}: нет файла {name}')
+                continue
+            with self.storage.open(name) as file:
+                post.image.name = self.storage.save(name, file)
+            post.updated_at = now
+            moved.append(post)
+            old_names.add(name)
+        Post.objects.bulk_update(moved, ['image', 'updated_at'])
+        return moved, old_names
+
+    def delete_originals(self, old_names):
+        """Удаляет старые файлы, на которые больше никто не ссылается."""
+        referenced = set(
+            Post.objects.filter(image__in=old_names)
+            .values_list('image', flat=True)
+        )
+        freed = 0
+        for name in old_names - referenced:
+            freed += self.storage.size(name)
+            self.storage.delete(name)
+        return freed
+
+    def handle(self, *args, **options):
+        self.storage = Post._meta.get_field('image').storage
+        batch_size = options['batch_size']
+        last_pk, checked, total_moved, total_freed = 0, 0, 0, 0
+        while True:
+            posts = list(
+                Post.objects.filter(pk__gt=last_pk).exclude(image='')
+                .select_related('author').order_by('pk')[:batch_size]
+            )
+            if not posts:
+                break
+            last_pk = posts[-1].pk
+            moved, old_names = self.move_batch(posts)
+            if not options['keep_originals']:
+                total_freed += self.delete_originals(old_names)
+            for post in moved:
+                if options['skip_thumbnails']:
+                    bump_post_scopes(post)
+                else:
+                    # Миниатюры привязаны к имени исходника, старые
+                    # больше не найдутся; их файлы убирает gc_media.
+                    thumbnails.generate(post.pk)
+            checked += len(posts)
+            total_moved += len(moved)
+            self.stdout.write(f'Проверено {checked}, перенесено {total_moved}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: перенесено {total_moved} файлов, удалено '
+            f'старых файлов на {total_freed} байт'
+        ))
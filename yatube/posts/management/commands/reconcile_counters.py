@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile, reconcile_comments
+from posts.models import Post
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Сверяет денормализованные счетчики с данными пачками.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько записей сверять за один проход.'
+        )
+
+    def reconcile_in_batches(self, queryset, reconcile_batch, label):
+        batch_size = self.batch_size
+        last_pk, checked, fixed = 0, 0, 0
+        while True:
+            ids = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            fixed += reconcile_batch(ids)
+            checked += len(ids)
+            last_pk = ids[-1]
+            self.stdout.write(f'{label}: проверено {checked}, '
+                              f'исправлено {fixed}')
+        return checked, fixed
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        users = self.reconcile_in_batches(
+            User.objects, reconcile, 'Пользователи'
+        )
+        posts = self.reconcile_in_batches(
+            Post.objects, reconcile_comments, 'Посты'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Готово: исправлено счетчиков пользователей {}, постов {}'.format(
+                users[1], posts[1]
+            )
+        ))
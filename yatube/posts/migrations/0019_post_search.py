@@ -0,0 +1,50 @@
+"""Полнотекстовый индекс FTS5 по тексту постов, см. posts.search.
+
+Таблица с внешним содержимым: текст хранится только в posts_post, а
+триггеры обновляют индекс при вставке, правке и удалении поста.
+SQLite пересоздает таблицу при изменении схемы и теряет триггеры,
+их восстанавливает posts.search.create_triggers после каждого migrate.
+"""
+from django.db import migrations
+
+CREATE = """
+CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+    text,
+    content='posts_post',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+CREATE TRIGGER posts_post_fts_insert AFTER INSERT ON posts_post BEGIN
+    INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER posts_post_fts_delete AFTER DELETE ON posts_post BEGIN
+    INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+    VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER posts_post_fts_update AFTER UPDATE OF text ON posts_post BEGIN
+    INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+    VALUES ('delete', old.id, old.text);
+    INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);
+END;
+INSERT INTO posts_post_fts(posts_post_fts) VALUES ('rebuild');
+"""
+
+# Более поздние миграции могли пересоздать posts_post без триггеров
+DROP = """
+DROP TRIGGER IF EXISTS posts_post_fts_update;
+DROP TRIGGER IF EXISTS posts_post_fts_delete;
+DROP TRIGGER IF EXISTS posts_post_fts_insert;
+DROP TABLE IF EXISTS posts_post_fts;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE, DROP),
+    ]
@@ -0,0 +1,35 @@
+"""Области кэша страниц приложения posts (см. core.cache).
+
+Содержимое страниц автора и группы зависит от областей по id: имя
+пользователя и адрес группы могут смениться, а id — нет. Адрес
+страницы зависит от области имени, которая сбрасывается, когда имя
+занимает или освобождает пользователь или группа.
+"""
+import hashlib
+
+INDEX = 'posts'
+
+
+def group(group_id):
+    return f'group:{group_id}'
+
+
+def author(author_id):
+    return f'author:{author_id}'
+
+
+def post(post_id):
+    return f'post:{post_id}'
+
+
+def _name(kind, value):
+    # Имя бывает не ASCII и длинным, а ключ кэша таким быть не должен.
+    return f'{kind}-name:{hashlib.md5(value.encode()).hexdigest()}'
+
+
+def username(name):
+    return _name('author', name)
+
+
+def group_slug(slug):
+    return _name('group', slug)
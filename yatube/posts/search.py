@@ -0,0 +1,156 @@
+"""Полнотекстовый поиск по постам.
+
+Виртуальная таблица FTS5 posts_post_fts (миграция 0019) индексирует
+Post.text и обновляется триггерами. Каждое слово запроса ищется как
+префикс («кот» находит «котики»), найденные посты сортируются по BM25
+и листаются курсором (rank, id), как ленты в posts.utils, без OFFSET.
+
+SQLite пересоздает posts_post при изменении схемы и теряет триггеры,
+поэтому после каждого migrate их восстанавливает create_triggers().
+
+Фрагмент текста с подсветкой строит snippet() из FTS5. Совпадения
+отмечаются управляющими символами, а не тегами: текст поста
+экранируется целиком, и только потом они заменяются на <mark>.
+"""
+import math
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .utils import (CURSOR_NEXT, CURSOR_PREVIOUS, CursorPage, decode_cursor,
+                    encode_cursor, is_row_id)
+
+TABLE = 'posts_post_fts'
+WORD = re.compile(r'\w+')
+MAX_WORDS = 8
+MARK_START, MARK_END = '\x02', '\x03'
+SNIPPET_TOKENS = 24
+TRIGGERS = (
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_insert AFTER INSERT ON posts_post
+    BEGIN
+        INSERT INTO {TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_delete AFTER DELETE ON posts_post
+    BEGIN
+        INSERT INTO {TABLE}({TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_update
+    AFTER UPDATE OF text ON posts_post
+    BEGIN
+        INSERT INTO {TABLE}({TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+)
+
+
+def create_triggers(using='default'):
+    """Создает недостающие триггеры индекса, если сам индекс есть."""
+    db = connections[using]
+    if db.vendor != 'sqlite' or TABLE not in db.introspection.table_names():
+        return
+    with db.cursor() as cursor:
+        for sql in TRIGGERS:
+            cursor.execute(sql)
+
+
+def match_expression(query):
+    """Выражение MATCH для запроса или '', если в нем нет слов."""
+    words = WORD.findall(query)[:MAX_WORDS]
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def matching(query):
+    """Условие фильтра: посты, текст которых подходит под запрос."""
+    return Q(pk__in=RawSQL(
+        f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s',
+        [match_expression(query)]
+    ))
+
+
+def highlight(snippet):
+    return mark_safe(
+        escape(snippet)
+        .replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+    )
+
+
+class SearchPaginator:
+    """Курсорная пагинация результатов поиска по (rank, id)."""
+
+    def __init__(self, query, per_page):
+        self.expression = match_expression(query)
+        self.per_page = int(per_page)
+
+    def _parse(self, token):
+        values = decode_cursor(token) if token else None
+        if not values or len(values) != 3:
+            return None
+        direction, rank, pk = values
+        if (direction not in (CURSOR_NEXT, CURSOR_PREVIOUS)
+                or not isinstance(rank, float) or not math.isfinite(rank)
+                or not is_row_id(pk)):
+            return None
+        return direction, rank, pk
+
+    def _rows(self, cursor):
+        """(id, rank, фрагмент) совпадений после курсора в его порядке."""
+        sql = (
+            f'SELECT rowid, rank, snippet({TABLE}, 0, %s, %s, %s, %s) '
+            f'FROM {TABLE} WHERE {TABLE} MATCH %s'
+        )
+        params = [MARK_START, MARK_END, '…', SNIPPET_TOKENS, self.expression]
+        order = 'ASC'
+        if cursor is not None:
+            direction, rank, pk = cursor
+            lookup, order = (
+                ('>', 'ASC') if direction == CURSOR_NEXT else ('<', 'DESC')
+            )
+            sql += (f' AND (rank {lookup} %s'
+                    f' OR (rank = %s AND rowid {lookup} %s))')
+            params += [rank, rank, pk]
+        sql += f' ORDER BY rank {order}, rowid {order} LIMIT %s'
+        params.append(self.per_page + 1)
+        with connection.cursor() as db:
+            db.execute(sql, params)
+            return db.fetchall()
+
+    def get_page(self, token):
+        """Страница результатов после или перед курсором.
+
+        Битый или пустой токен отдает первую страницу.
+        """
+        cursor = self._parse(token)
+        rows = self._rows(cursor)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if cursor is None:
+            has_next, has_previous = has_more, False
+        elif cursor[0] == CURSOR_NEXT:
+            has_next, has_previous = has_more, True
+        else:
+            has_next, has_previous = True, has_more
+            rows.reverse()
+        posts = Post.objects.select_related('author', 'group').in_bulk(
+            [pk for pk, _, _ in rows]
+        )
+        object_list = []
+        for pk, _, snippet in rows:
+            # Пост могли удалить между двумя запросами
+            if pk in posts:
+                posts[pk].snippet = highlight(snippet)
+                object_list.append(posts[pk])
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            pk, rank, _ = rows[-1]
+            next_cursor = encode_cursor(CURSOR_NEXT, rank, pk)
+        if rows and has_previous:
+            pk, rank, _ = rows[0]
+            previous_cursor = encode_cursor(CURSOR_PREVIOUS, rank, pk)
+        return CursorPage(object_list, self, next_cursor, previous_cursor)
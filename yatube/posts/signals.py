@@ -0,0 +1,163 @@
+from django.db.models.signals import (
+    post_delete, post_init, post_migrate, post_save, pre_delete
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.cache import bump
+
+from . import counters, scopes, search, timeline
+from .models import Comment, Follow, Group, Post, User
+
+
+@receiver(post_init, sender=Post)
+def post_loaded(sender, instance, **kwargs):
+    """Запоминает группу и автора, чтобы при смене сбросить и старые."""
+    instance._initial_group_id = instance.__dict__.get('group_id')
+    instance._initial_author_id = instance.__dict__.get('author_id')
+
+
+def bump_post_scopes(post):
+    group_ids = {post.group_id, getattr(post, '_initial_group_id', None)}
+    author_ids = {post.author_id, getattr(post, '_initial_author_id', None)}
+    bump(
+        scopes.INDEX,
+        scopes.post(post.pk),
+        *(scopes.author(author_id) for author_id in author_ids - {None}),
+        *(scopes.group(group_id) for group_id in group_ids - {None})
+    )
+    post._initial_group_id = post.group_id
+    post._initial_author_id = post.author_id
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    """Раскладывает новый пост по лентам и обновляет счетчик автора."""
+    if created:
+        counters.change(instance.author_id, posts_count=1)
+        timeline.fan_out(instance)
+    bump_post_scopes(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change(instance.author_id, posts_count=-1)
+    bump_post_scopes(instance)
+
+
+def bump_follow_scopes(follow):
+    bump(scopes.author(follow.user_id), scopes.author(follow.author_id))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    """Заполняет ленту постами автора после подписки."""
+    if created:
+        counters.change(instance.author_id, followers_count=1)
+        counters.change(instance.user_id, following_count=1)
+        timeline.backfill(instance.user_id, instance.author_id)
+        bump_follow_scopes(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    """Убирает посты автора из ленты после отписки."""
+    counters.change(instance.author_id, followers_count=-1)
+    counters.change(instance.user_id, following_count=-1)
+    timeline.trim(instance.user_id, instance.author_id)
+    bump_follow_scopes(instance)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments(instance.post_id, 1)
+    bump(scopes.post(instance.post_id))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_comments(instance.post_id, -1)
+    bump(scopes.post(instance.post_id))
+
+
+@receiver(post_init, sender=Group)
+def group_loaded(sender, instance, **kwargs):
+    """Запоминает адрес, чтобы при смене сбросить и старый."""
+    instance._initial_slug = instance.__dict__.get('slug')
+
+
+def refresh_group_posts(group):
+    """Название и адрес группы выводятся в карточках ее постов."""
+    group.posts.update(updated_at=timezone.now())
+    author_ids = group.posts.values_list('author_id', flat=True).distinct()
+    slugs = {group.slug, group._initial_slug} - {None}
+    bump(
+        scopes.INDEX,
+        scopes.group(group.pk),
+        *(scopes.group_slug(slug) for slug in slugs),
+        *(scopes.author(author_id) for author_id in author_ids)
+    )
+    group._initial_slug = group.slug
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, **kwargs):
+    refresh_group_posts(instance)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    """Посты удаляемой группы остаются без нее."""
+    refresh_group_posts(instance)
+
+
+def shown_name(user):
+    """Поля пользователя, которые выводятся на страницах постов."""
+    return tuple(
+        user.__dict__.get(name)
+        for name in ('username', 'first_name', 'last_name')
+    )
+
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    """Запоминает имя, чтобы обновить страницы только при его смене."""
+    instance._initial_name = shown_name(instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    """Имя автора выводится в карточках, а по username ищется профиль."""
+    name, initial_name = shown_name(instance), instance._initial_name
+    instance._initial_name = name
+    if created:
+        bump(scopes.username(instance.username))
+        return
+    if name == initial_name:
+        return
+    usernames = {instance.username, initial_name[0]} - {None}
+    posts = Post.objects.filter(author=instance)
+    posts.update(updated_at=timezone.now())
+    group_ids = posts.exclude(group=None).values_list(
+        'group_id', flat=True
+    ).distinct()
+    bump(
+        scopes.INDEX,
+        scopes.author(instance.pk),
+        *(scopes.username(username) for username in usernames),
+        *(scopes.group(group_id) for group_id in group_ids)
+    )
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """Освободившееся имя может занять новый пользователь."""
+    bump(scopes.author(instance.pk), scopes.username(instance.username))
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    """Возвращает триггеры поиска, если миграция пересоздала posts_post."""
+    if sender.label == 'posts':
+        search.create_triggers(using)
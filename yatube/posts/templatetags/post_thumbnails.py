@@ -0,0 +1,52 @@
+from django import template
+from django.conf import settings
+from django.utils.html import format_html
+from sorl.thumbnail.parsers import parse_geometry
+
+from .. import thumbnails
+
+register = template.Library()
+
+CARD_SIZES = '(max-width: 960px) 100vw, 960px'
+
+
+@register.simple_tag
+def post_image(post, name, sizes=CARD_SIZES, css_class='card-img my-2'):
+    """Картинка поста со srcset из миниатюр POST_THUMBNAIL_SRCSET[name].
+
+    Картинка грузится лениво, а width и height берутся из сохраненных
+    размеров миниатюры, чтобы страница не прыгала при загрузке. Пока
+    миниатюр нет, выводится блок с теми же пропорциями. Под картинкой
+    и в блоке видна заглушка поста (LQIP), если она есть.
+    """
+    if not post.image:
+        return ''
+    if getattr(post, 'thumbnails', None) is None:
+        thumbnails.attach([post])
+    names = settings.POST_THUMBNAIL_SRCSET[name]
+    ready = [post.thumbnails[size] for size in names if post.thumbnails[size]]
+    background = ''
+    if post.image_placeholder:
+        background = format_html(
+            'background: url({}) center / cover no-repeat; ',
+            post.image_placeholder
+        )
+    if not ready:
+        geometry = settings.POST_THUMBNAILS[names[0]][0]
+        width, height = parse_geometry(geometry)
+        return format_html(
+            '<div class="{} bg-light thumbnail-placeholder" '
+            'style="{}aspect-ratio: {} / {}"></div>',
+            css_class, background, width, height
+        )
+    largest = max(ready, key=lambda thumbnail: thumbnail.width)
+    srcset = ', '.join(
+        f'{thumbnail.url} {thumbnail.width}w' for thumbnail in ready
+    )
+    style = format_html(' style="{}"', background) if background else ''
+    return format_html(
+        '<img class="{}" src="{}" srcset="{}" sizes="{}" width="{}" '
+        'height="{}"{} loading="lazy" decoding="async" alt="">',
+        css_class, largest.url, srcset, sizes, largest.width, largest.height,
+        style
+    )
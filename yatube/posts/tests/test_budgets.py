@@ -0,0 +1,187 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from .. import urls
+from ..budgets import QUERY_BUDGETS
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+PAGE_SIZES = (1, 100)
+
+
+class QueryBudgetMixin:
+    """Проверка числа запросов view по реестру posts.budgets."""
+
+    def assertWithinBudget(self, url, method='get', data=None,
+                           client=None):
+        client = client or self.client
+        name = resolve(url.split('?')[0]).url_name
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, data)
+        self.assertLess(response.status_code, 400, url)
+        self.assertLessEqual(
+            len(queries), QUERY_BUDGETS[name],
+            f'{method.upper()} {url}: {len(queries)} запросов при '
+            f'бюджете {QUERY_BUDGETS[name]}:\n'
+            + '\n'.join(query['sql'] for query in queries)
+        )
+        return response
+
+
+# Знаменитость — автор больше чем с одним подписчиком
+@override_settings(TIMELINE_FANOUT_LIMIT=1)
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        authors = [
+            User.objects.create_user(username=f'author{number}')
+            for number in range(10)
+        ]
+        cls.author = authors[0]
+        # На него читатель подписывается и отписывается в замерах
+        cls.newcomer = User.objects.create_user(username='newcomer')
+        for number in range(5):
+            Post.objects.create(author=cls.newcomer, text=f'Новый {number}')
+        # Через create, а не bulk_create: сигналы ведут счетчики
+        for author in authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        for number in range(100):
+            Post.objects.create(
+                author=authors[number % len(authors)], group=cls.group,
+                text=f'Пост {number}'
+            )
+        cls.post = Post.objects.filter(author=cls.author).first()
+        # Посты знаменитостей не раскладываются, а переносятся в ленту
+        # читателя при чтении
+        fan = User.objects.create_user(username='fan')
+        cls.celebrities = [
+            User.objects.create_user(username=f'celebrity{number}')
+            for number in range(3)
+        ]
+        for celebrity in cls.celebrities:
+            Post.objects.create(author=celebrity, text='Пост знаменитости')
+            Follow.objects.create(user=fan, author=celebrity)
+            Follow.objects.create(user=cls.reader, author=celebrity)
+        commenters = [cls.reader, *authors]
+        for number in range(100):
+            Comment.objects.create(
+                post=cls.post, author=commenters[number % len(commenters)],
+                text=f'Комментарий {number}'
+            )
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def cases(self):
+        """(адрес, метод, данные, клиент) для каждого имени URL."""
+        username = self.author.username
+        post_id = self.post.pk
+        return {
+            'posts': [(reverse('posts:posts'), 'get', None, self.client)],
+            'group_posts': [(
+                reverse('posts:group_posts', args=[self.group.slug]),
+                'get', None, self.client
+            )],
+            'profile': [(
+                reverse('posts:profile', args=[username]), 'get', None,
+                self.reader_client
+            )],
+            'post_detail': [(
+                reverse('posts:post_detail', args=[post_id]), 'get', None,
+                self.reader_client
+            )],
+            'comments': [(
+                reverse('posts:comments', args=[post_id]), 'get', None,
+                self.client
+            )],
+            'add_comment': [(
+                reverse('posts:add_comment', args=[post_id]), 'post',
+                {'text': 'Новый'}, self.reader_client
+            )],
+            'post_create': [
+                (reverse('posts:post_create'), 'get', None,
+                 self.reader_client),
+                (reverse('posts:post_create'), 'post',
+                 {'text': 'Новый', 'group': self.group.pk},
+                 self.reader_client),
+            ],
+            'post_edit': [
+                (reverse('posts:post_edit', args=[post_id]), 'get', None,
+                 self.author_client),
+                (reverse('posts:post_edit', args=[post_id]), 'post',
+                 {'text': 'Правка'}, self.author_client),
+            ],
+            'follow_index': [(
+                reverse('posts:follow_index'), 'get', None,
+                self.reader_client
+            )],
+            'search': [(
+                reverse('posts:search') + '?q=пост', 'get', None, self.client
+            )],
+            'profile_follow': [(
+                reverse('posts:profile_follow',
+                        args=[self.newcomer.username]),
+                'get', None, self.reader_client
+            )],
+            'profile_unfollow': [(
+                reverse('posts:profile_unfollow',
+                        args=[self.newcomer.username]),
+                'get', None, self.reader_client
+            )],
+        }
+
+    def following(self):
+        return Follow.objects.filter(
+            user=self.reader, author=self.newcomer
+        ).exists()
+
+    def prepare(self, name):
+        """Данные перед замером такие, чтобы view писал в базу.
+
+        Перед чтением ленты у каждой знаменитости выходит новый пост.
+        """
+        if name == 'follow_index':
+            for celebrity in self.celebrities:
+                Post.objects.create(author=celebrity, text='Новый')
+        elif name == 'profile_follow':
+            Follow.objects.filter(
+                user=self.reader, author=self.newcomer
+            ).delete()
+        elif name == 'profile_unfollow' and not self.following():
+            Follow.objects.create(user=self.reader, author=self.newcomer)
+
+    def test_every_url_has_budget(self):
+        """У каждого URL из posts/urls.py есть бюджет и проверка."""
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names, set(QUERY_BUDGETS))
+        self.assertEqual(names, set(self.cases()))
+
+    def test_views_within_budget(self):
+        """View укладываются в бюджет при страницах из 1 и 100 записей."""
+        for size in PAGE_SIZES:
+            with override_settings(CONSTANT=size, COMMENTS_PER_PAGE=size):
+                for name, requests in self.cases().items():
+                    for url, method, data, client in requests:
+                        with self.subTest(view=name, method=method,
+                                          page_size=size):
+                            self.prepare(name)
+                            self.assertWithinBudget(url, method, data,
+                                                    client)
+                            if name in ('profile_follow',
+                                        'profile_unfollow'):
+                                self.assertEqual(
+                                    self.following(),
+                                    name == 'profile_follow'
+                                )
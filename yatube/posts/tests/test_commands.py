@@ -0,0 +1,280 @@
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from sorl.thumbnail.models import KVStore
+
+from core.cache import get_generations
+
+from .. import scopes, thumbnails
+from ..management.commands import gc_media
+from ..models import Comment, Follow, Group, Post, TimelineEntry, UserCounter
+from .utils import create_post
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def gif(color):
+    buffer = BytesIO()
+    Image.new('RGB', (20, 10), color).save(buffer, 'GIF')
+    return buffer.getvalue()
+
+
+class GenerateDataTest(TestCase):
+    options = {'users': 60, 'groups': 3, 'posts': 200, 'comments': 100,
+               'follows': 400, 'batch_size': 50, 'force': True}
+
+    def generate(self, seed):
+        call_command('generate_data', seed=seed, stdout=StringIO(),
+                     **self.options)
+        return (
+            list(User.objects.order_by('pk').values_list('username')),
+            list(Post.objects.order_by('pk').values_list(
+                'author__username', 'text', 'pub_date', 'group__slug'
+            )),
+            list(Follow.objects.order_by('pk').values_list(
+                'user__username', 'author__username'
+            )),
+        )
+
+    def clear(self):
+        for model in (Comment, Follow, Post, Group, User):
+            model.objects.all().delete()
+
+    def test_same_seed_gives_same_data(self):
+        """Одинаковый seed дает одинаковые данные, другой — другие."""
+        first = self.generate(seed=7)
+        self.clear()
+        self.assertEqual(self.generate(seed=7), first)
+        self.clear()
+        self.assertNotEqual(self.generate(seed=8), first)
+
+    def test_generated_data_is_consistent(self):
+        """Счетчики и ленты сходятся, а подписчики распределены неравно."""
+        with override_settings(TIMELINE_FANOUT_LIMIT=30):
+            self.generate(seed=1)
+        self.assertEqual(User.objects.count(), 60)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 100)
+        followers = sorted(
+            UserCounter.objects.values_list('followers_count', flat=True),
+            reverse=True
+        )
+        self.assertEqual(sum(followers), Follow.objects.count())
+        # Степенной закон: у первого автора подписчиков в разы больше,
+        # чем у медианного
+        self.assertGreater(followers[0], 5 * max(followers[30], 1))
+        post = Post.objects.order_by('-comments_count').first()
+        self.assertEqual(post.comments_count, post.comments.count())
+        follow = Follow.objects.filter(
+            author__counter__followers_count__lte=30,
+            author__posts__isnull=False,
+        ).first()
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=follow.user, post__author=follow.author
+        ).exists())
+
+    def test_refuses_without_debug(self):
+        """Без DEBUG команда не трогает базу без --force."""
+        with self.assertRaises(CommandError):
+            call_command('generate_data', users=1, stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+
+
+class BenchmarkViewsTest(TestCase):
+    def setUp(self):
+        call_command('generate_data', users=20, groups=2, posts=40,
+                     comments=20, follows=60, force=True, stdout=StringIO())
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.baseline = os.path.join(directory, 'benchmarks.json')
+
+    def benchmark(self, **options):
+        out = StringIO()
+        call_command('benchmark_views', iterations=3, warmup=1,
+                     baseline=self.baseline, stdout=out, **options)
+        return out.getvalue()
+
+    def test_baseline_saved_and_compared(self):
+        """Результаты сохраняются, и повторный прогон с ними сверяется."""
+        self.benchmark(save=True, cold=True)
+        with open(self.baseline) as file:
+            stored = json.load(file)['cold']
+        self.assertEqual(set(stored), {
+            'index', 'group_posts', 'profile', 'post_detail',
+            'follow_index', 'post_create', 'post_edit', 'add_comment',
+            'profile_follow', 'profile_unfollow',
+        })
+        self.assertGreater(stored['index']['queries'], 0)
+        self.assertGreater(stored['index']['bytes'], 0)
+        self.assertIn('регрессий нет', self.benchmark(
+            cold=True, tolerance=100, min_delta=1000
+        ))
+
+    def test_writes_are_rolled_back(self):
+        """Замеры пишущих view не меняют данные."""
+        posts = Post.objects.count()
+        self.benchmark(views=['post_create', 'add_comment'])
+        self.assertEqual(Post.objects.count(), posts)
+
+    def test_site_cache_untouched(self):
+        """Замеры не сбрасывают поколения и не очищают кэш сайта."""
+        generation = get_generations([scopes.INDEX])
+        cache.set('benchmark-marker', 1)
+        self.benchmark(cold=True, views=['post_create', 'add_comment'])
+        self.assertEqual(get_generations([scopes.INDEX]), generation)
+        self.assertEqual(cache.get('benchmark-marker'), 1)
+
+    def test_follow_cases_write(self):
+        """Подписка и отписка замеряются с настоящей записью в базу."""
+        follows = Follow.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            self.benchmark(views=['profile_follow', 'profile_unfollow'])
+        table = Follow._meta.db_table
+        written = [query['sql'].split(' ', 1)[0] for query in queries
+                   if f'"{table}"' in query['sql']]
+        # 4 подписки и 4 подписки перед отписками; удалять перед
+        # подпиской нечего, поэтому удаляют только 4 отписки
+        self.assertEqual(written.count('INSERT'), 8)
+        self.assertEqual(written.count('DELETE'), 4)
+        self.assertEqual(Follow.objects.count(), follows)
+
+    def test_query_regression_fails(self):
+        """Рост числа запросов против базовых результатов — ошибка."""
+        self.benchmark(save=True, cold=True, views=['index'])
+        with open(self.baseline) as file:
+            stored = json.load(file)
+        stored['cold']['index']['queries'] -= 1
+        with open(self.baseline, 'w') as file:
+            json.dump(stored, file)
+        with self.assertRaisesMessage(CommandError, 'index: запросов'):
+            self.benchmark(cold=True, tolerance=100, min_delta=1000,
+                           views=['index'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaCommandsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_migrate_media_command(self):
+        """migrate_media переносит старые файлы под имена по хэшу."""
+        legacy = os.path.join(TEMP_MEDIA_ROOT, 'posts', 'legacy.gif')
+        os.makedirs(os.path.dirname(legacy), exist_ok=True)
+        with open(legacy, 'wb') as file:
+            file.write(b'legacy')
+        post = Post.objects.create(author=self.author, text='Старый пост')
+        Post.objects.filter(pk=post.pk).update(image='posts/legacy.gif')
+        call_command('migrate_media', batch_size=1, skip_thumbnails=True,
+                     stdout=StringIO())
+        post.refresh_from_db()
+        storage = post.image.storage
+        self.assertTrue(storage.is_content_name(post.image.name))
+        with post.image.open() as file:
+            self.assertEqual(file.read(), b'legacy')
+        self.assertFalse(os.path.exists(legacy))
+
+    def test_gc_media_command(self):
+        """gc_media удаляет картинки без постов и их миниатюры."""
+        kept = create_post(self.author, 'kept.gif', gif('red'))
+        removed = create_post(self.author, 'removed.gif', gif('blue'))
+        thumbnails.generate(kept.pk)
+        thumbnails.generate(removed.pk)
+        storage = removed.image.storage
+        removed_path = storage.path(removed.image.name)
+        kept_thumbnails = [
+            thumbnails.lookup(kept.image, size).name
+            for size in settings.POST_THUMBNAILS
+        ]
+        removed_thumbnails = [
+            thumbnails.lookup(removed.image, size).name
+            for size in settings.POST_THUMBNAILS
+        ]
+        removed.delete()
+        keys_before = KVStore.objects.count()
+        out = StringIO()
+        call_command('gc_media', min_age=0, rate=0, stdout=out)
+        self.assertTrue(kept.image.storage.exists(kept.image.name))
+        self.assertFalse(os.path.exists(removed_path))
+        for name in kept_thumbnails:
+            self.assertTrue(storage.exists(name))
+        for name in removed_thumbnails:
+            self.assertFalse(storage.exists(name))
+        # Исходник, список его миниатюр и по записи на каждую миниатюру
+        self.assertEqual(
+            KVStore.objects.count(),
+            keys_before - 2 - len(settings.POST_THUMBNAILS)
+        )
+        self.assertIn(f'удалено {1 + len(removed_thumbnails)} файлов',
+                      out.getvalue())
+
+    def test_gc_media_keeps_fresh_files(self):
+        """gc_media не трогает свежие файлы и ничего не удаляет в dry-run."""
+        orphan = create_post(self.author, 'orphan.gif', gif('green'))
+        Post.objects.filter(pk=orphan.pk).delete()
+        path = orphan.image.storage.path(orphan.image.name)
+        call_command('gc_media', rate=0, stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+        call_command('gc_media', min_age=0, dry_run=True, stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+
+    def test_reupload_refreshes_orphan(self):
+        """Повторная загрузка старого файла делает его снова свежим."""
+        orphan = create_post(self.author, 'orphan.gif', gif('green'))
+        Post.objects.filter(pk=orphan.pk).delete()
+        path = orphan.image.storage.path(orphan.image.name)
+        os.utime(path, (0, 0))
+        # Пост с этой картинкой еще не сохранен
+        orphan.image.storage.save('posts/again.gif', ContentFile(gif('green')))
+        call_command('gc_media', rate=0, stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+
+    def test_gc_media_rechecks_before_delete(self):
+        """Файл, на который сослался новый пост во время пачки, остается."""
+        orphan = create_post(self.author, 'orphan.gif', gif('green'))
+        Post.objects.filter(pk=orphan.pk).delete()
+        path = orphan.image.storage.path(orphan.image.name)
+
+        def reuse(command):
+            Post.objects.create(author=self.author, text='Новый пост',
+                                image=orphan.image.name)
+
+        with mock.patch.object(gc_media.Command, 'throttle', reuse):
+            call_command('gc_media', min_age=0, rate=0, stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+
+    def test_gc_media_dry_run_counts_thumbnails(self):
+        """Пробный запуск насчитывает столько же файлов, сколько удалит."""
+        removed = create_post(self.author, 'removed.gif', gif('blue'))
+        thumbnails.generate(removed.pk)
+        removed.delete()
+        dry_run, real = StringIO(), StringIO()
+        call_command('gc_media', min_age=0, rate=0, dry_run=True,
+                     stdout=dry_run)
+        call_command('gc_media', min_age=0, rate=0, stdout=real)
+        self.assertEqual(
+            dry_run.getvalue().splitlines()[-1],
+            real.getvalue().splitlines()[-1].replace(
+                'удалено', 'будет удалено'
+            )
+        )
@@ -1,3 +1,4 @@
+import io
 import shutil
 import tempfile
 from http import HTTPStatus
@@ -7,12 +8,13 @@ from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
 from ..models import Group, Post
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
-image_way = 'posts/small.gif'
+image_way = r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.webp$'
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -102,7 +104,7 @@ class PostViewTest(TestCase):
         self.first_object(response)
         self.assertEqual(Post.objects.count(), posts_count + 1)
         self.assertEqual(selection.group.title, form_data['title'])
-        self.assertEqual(selection.image, image_way)
+        self.assertRegex(selection.image.name, image_way)
 
     def first_object(self, response):
         """Шаблон create_post и create with image общие процессы."""
@@ -112,3 +114,33 @@ class PostViewTest(TestCase):
         self.assertEqual(selection.text, self.post.text)
         self.assertEqual(selection.author, self.user)
         self.assertEqual(selection.group, self.group)
+
+    @override_settings(POST_IMAGE_MAX_SIDE=300)
+    def test_uploaded_image_is_normalized(self):
+        """Картинка поворачивается, уменьшается и теряет EXIF."""
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90 градусов
+        exif[0x010F] = 'Camera'  # Make
+        Image.new('RGB', (3000, 1000), 'red').save(
+            buffer, 'JPEG', exif=exif
+        )
+        uploaded = SimpleUploadedFile(
+            name='photo.jpg',
+            content=buffer.getvalue(),
+            content_type='image/jpeg'
+        )
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Фото', 'image': uploaded},
+        )
+        post = Post.objects.latest('pk')
+        self.assertRegex(post.image.name, image_way)
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/webp;base64,')
+        )
+        self.assertLess(len(post.image_placeholder), 400)
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (100, 300))
+            self.assertFalse(image.getexif())
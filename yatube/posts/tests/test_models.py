@@ -1,9 +1,21 @@
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-from ..models import Group, Post
+from ..counters import get_counter
+from ..models import Comment, Follow, Group, Post, UserCounter
+from .utils import create_post
 
 User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
 class PostModelTest(TestCase):
@@ -32,3 +44,93 @@ class PostModelTest(TestCase):
         group = PostModelTest.group
         result = group.title
         self.assertEqual(str(group), result, 'Проверь работу group models')
+
+
+class UserCounterTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.follower = User.objects.create_user(username='follower')
+
+    def test_counters_follow_posts_and_follows(self):
+        """Счетчики меняются при создании и удалении постов и подписок."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        follow = Follow.objects.create(user=self.follower, author=self.author)
+        author = User.objects.select_related('counter').get(pk=self.author.pk)
+        self.assertEqual(get_counter(author).posts_count, 1)
+        self.assertEqual(get_counter(author).followers_count, 1)
+        self.assertEqual(UserCounter.objects.get(
+            user=self.follower).following_count, 1)
+        post.delete()
+        follow.delete()
+        counter = UserCounter.objects.get(user=self.author)
+        self.assertEqual(counter.posts_count, 0)
+        self.assertEqual(counter.followers_count, 0)
+
+    def test_counters_do_not_go_below_zero(self):
+        """Разошедшийся счетчик при уменьшении остается нулем."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.follower, text='Комментарий'
+        )
+        Post.objects.filter(pk=post.pk).update(comments_count=0)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        UserCounter.objects.filter(user=self.author).update(posts_count=0)
+        post.delete()
+        self.assertEqual(
+            UserCounter.objects.get(user=self.author).posts_count, 0
+        )
+
+    def test_reconcile_counters_command(self):
+        """Команда reconcile_counters исправляет расхождения."""
+        Post.objects.create(author=self.author, text='Пост')
+        Follow.objects.create(user=self.follower, author=self.author)
+        UserCounter.objects.filter(user=self.author).update(
+            posts_count=10, followers_count=0
+        )
+        UserCounter.objects.filter(user=self.follower).delete()
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        author = UserCounter.objects.get(user=self.author)
+        self.assertEqual(author.posts_count, 1)
+        self.assertEqual(author.followers_count, 1)
+        self.assertEqual(UserCounter.objects.get(
+            user=self.follower).following_count, 1)
+
+    def test_post_detail_reads_counters_without_aggregates(self):
+        """Страница поста не считает посты автора агрегатным запросом."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('posts:post_detail', kwargs={'post_id': post.pk})
+            )
+        self.assertEqual(response.context['count_list'], 1)
+        for query in queries:
+            self.assertNotIn('COUNT(', query['sql'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaStorageTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_identical_images_stored_once(self):
+        """Одинаковые картинки хранятся одним файлом по хэшу."""
+        first = create_post(self.author, 'first.gif', b'same')
+        second = create_post(self.author, 'second.gif', b'same')
+        other = create_post(self.author, 'other.gif', b'other')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertRegex(
+            first.image.name,
+            r'^posts/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.gif$'
+        )
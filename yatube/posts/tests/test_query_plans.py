@@ -0,0 +1,93 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+from ..utils import encode_cursor
+
+User = get_user_model()
+TABLE_SCAN = re.compile(r'SCAN (?:TABLE )?(\S+)(?: AS \S+)?$')
+CO_ROUTINE = re.compile(r'CO-ROUTINE (\S+)')
+
+
+class QueryPlanTests(TestCase):
+    """Запросы лент не сканируют таблицы целиком и не сортируют.
+
+    Проверяются планы всех запросов, которые выполняет страница.
+    Просмотр индекса целиком (SCAN ... USING INDEX) допустим: так
+    главная лента читается по индексу с LIMIT.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост'
+        )
+        Comment.objects.create(post=cls.post, author=cls.user, text='Текст')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def next_cursor(self):
+        return '?cursor=' + encode_cursor(
+            'n', self.post.pub_date.isoformat(), self.post.pk
+        )
+
+    def assertPlansUseIndexes(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        for query in queries.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[3] for row in cursor.fetchall()]
+            co_routines = {
+                match.group(1) for match in map(CO_ROUTINE.match, plan)
+                if match
+            }
+            for detail in plan:
+                scan = TABLE_SCAN.match(detail)
+                with self.subTest(url=url, sql=query['sql']):
+                    self.assertNotIn('TEMP B-TREE', detail)
+                    self.assertFalse(
+                        scan and scan.group(1) not in co_routines, detail
+                    )
+
+    def test_feed_plans(self):
+        """Ленты, профиль и группа читаются по индексам."""
+        for url in (
+            reverse('posts:posts'),
+            reverse('posts:group_posts', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:follow_index'),
+        ):
+            self.assertPlansUseIndexes(url)
+            self.assertPlansUseIndexes(url + self.next_cursor())
+
+    def test_comments_plans(self):
+        """Комментарии поста читаются по индексу (post, pub_date)."""
+        self.assertPlansUseIndexes(
+            reverse('posts:post_detail', args=[self.post.pk])
+        )
+        self.assertPlansUseIndexes(
+            reverse('posts:comments', args=[self.post.pk])
+            + self.next_cursor()
+        )
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_celebrity_pull_plans(self):
+        """Перенос постов знаменитостей в ленту читает индекс автора."""
+        self.assertPlansUseIndexes(reverse('posts:follow_index'))
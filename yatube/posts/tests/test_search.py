@@ -0,0 +1,112 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from ..models import Post
+from ..search import SearchPaginator, matching
+from ..utils import encode_cursor
+
+User = get_user_model()
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    def create_post(self, text):
+        return Post.objects.create(author=self.user, text=text)
+
+    def found(self, query):
+        return set(
+            Post.objects.filter(matching(query)).values_list('pk', flat=True)
+        )
+
+    def test_triggers_exist(self):
+        """Триггеры индекса на месте: SQLite теряет их при смене схемы."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                "AND tbl_name = 'posts_post'"
+            )
+            triggers = {name for name, in cursor.fetchall()}
+        self.assertEqual(triggers, {
+            'posts_post_fts_insert', 'posts_post_fts_update',
+            'posts_post_fts_delete',
+        })
+
+    def test_index_follows_posts(self):
+        """Индекс обновляется при создании, правке и удалении поста."""
+        post = self.create_post('Рыжий котик спит')
+        self.assertEqual(self.found('кот'), {post.pk})
+        post.text = 'Собака гуляет'
+        post.save()
+        self.assertEqual(self.found('кот'), set())
+        self.assertEqual(self.found('собака'), {post.pk})
+        post.delete()
+        self.assertEqual(self.found('собака'), set())
+
+    def test_query_syntax_is_not_interpreted(self):
+        """Кавычки и операторы FTS5 в запросе не ломают поиск."""
+        post = self.create_post('Кот NOT собака')
+        self.assertEqual(self.found('"кот" NOT * ('), {post.pk})
+        self.assertEqual(self.found('NEAR(кот'), set())
+
+    def test_results_ranked_and_paginated(self):
+        """Результаты идут по BM25 и листаются курсором в обе стороны."""
+        best = self.create_post('кот кот кот')
+        others = [self.create_post(f'кот и пёс {i} ' * 5) for i in range(4)]
+        self.create_post('только пёс')
+        paginator = SearchPaginator('кот', 2)
+        first = paginator.get_page(None)
+        self.assertEqual(first[0], best)
+        self.assertFalse(first.has_previous())
+        second = paginator.get_page(first.next_cursor)
+        third = paginator.get_page(second.next_cursor)
+        self.assertFalse(third.has_next())
+        found = [*first, *second, *third]
+        self.assertCountEqual(found, [best, *others])
+        self.assertEqual(
+            list(paginator.get_page(third.previous_cursor)), list(second)
+        )
+
+    def test_crafted_cursor_returns_first_page(self):
+        """Курсор с огромным id или бесконечным rank отдает первую страницу."""
+        post = self.create_post('hello')
+        tokens = {
+            'id 10**30': encode_cursor('n', 1.0, 10 ** 30),
+            'rank inf': encode_cursor('n', float('inf'), post.pk),
+            'rank nan': encode_cursor('n', float('nan'), post.pk),
+        }
+        for name, token in tokens.items():
+            with self.subTest(name=name):
+                response = self.client.get(
+                    reverse('posts:search'), {'q': 'hello', 'cursor': token}
+                )
+                self.assertEqual(list(response.context['page_obj']), [post])
+
+    def test_search_view_highlights_and_escapes(self):
+        """Совпадения подсвечиваются, а HTML из текста экранируется."""
+        self.create_post('<b>Котик</b> и <script>alert(1)</script>')
+        response = self.client.get(reverse('posts:search'), {'q': 'котик'})
+        content = response.content.decode()
+        self.assertIn('<mark>Котик</mark>', content)
+        self.assertIn('&lt;script&gt;', content)
+        self.assertNotIn('<script>alert', content)
+        self.assertEqual(len(response.context['page_obj']), 1)
+
+
+class SearchMigrationTest(TransactionTestCase):
+    def test_migrate_backwards(self):
+        """Откат до 0018 проходит, хотя триггеры уже потеряны."""
+        call_command('migrate', 'posts', '0018', verbosity=0)
+        self.assertNotIn(
+            'posts_post_fts', connection.introspection.table_names()
+        )
+        call_command('migrate', 'posts', verbosity=0)
+        self.assertIn(
+            'posts_post_fts', connection.introspection.table_names()
+        )
@@ -38,6 +38,7 @@ class PostURLTests(TestCase):
             f'/group/{self.group.slug}/',
             f'/profile/{self.user}/',
             f'/posts/{self.post.pk}/',
+            '/search/?q=текст',
         )
         for url in url_names:
             with self.subTest():
@@ -65,7 +66,8 @@ class PostURLTests(TestCase):
             f'/posts/{self.post.pk}/': 'posts/post_detail.html',
             '/create/': 'posts/create_post.html',
             f'/posts/{self.post.pk}/edit/': 'posts/create_post.html',
-            '/follow/': 'posts/follow.html'
+            '/follow/': 'posts/follow.html',
+            '/search/': 'posts/search.html',
         }
         for url, template in templates_url_names.items():
             with self.subTest(adress=url):
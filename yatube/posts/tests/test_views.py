@@ -1,19 +1,39 @@
 import shutil
 import tempfile
+import warnings
+from io import StringIO
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.db import transaction
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
 from django.urls import reverse
+from django.utils import timezone
 
-from ..models import Post, Group, Comment, Follow
+from core.fragments import stitch
+
+from .. import thumbnails
+from ..cards import render_cards
+from ..models import Post, Group, Comment, Follow, TimelineEntry
+from ..utils import FeedPaginator, encode_cursor
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 comment_pk = 1
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -104,7 +124,7 @@ class PostPagesTests(TestCase):
         self.assertEqual(group_title_0, self.group.title)
         self.assertEqual(group_slug_0, self.group.slug)
         self.assertEqual(group_description_0, self.group.description)
-        self.assertEqual(post_image_0, 'posts/small.gif')
+        self.assertEqual(post_image_0, self.post.image.name)
 
     def test_profile_page_show_correct_context(self):
         """Шаблон profile сформирован с правильны контекстом."""
@@ -119,7 +139,7 @@ class PostPagesTests(TestCase):
             'posts:post_detail', kwargs={'post_id': f'{self.post.pk}'})
         )
         ctx = response.context
-        self.assertEqual(ctx['post'].image, 'posts/small.gif')
+        self.assertEqual(ctx['post'].image, self.post.image.name)
         self.assertEqual(ctx['author'].pk, self.user.pk)
         self.assertEqual(ctx['post'].pk, self.post.pk)
 
@@ -179,7 +199,98 @@ class PostPagesTests(TestCase):
         self.assertEqual(post_author_0, f'{self.user}')
         self.assertEqual(post_text_0, self.post.text)
         self.assertEqual(post_id_0, self.post.pk)
-        self.assertEqual(post_image_0, 'posts/small.gif')
+        self.assertEqual(post_image_0, self.post.image.name)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def create_post(self):
+        self.authorized_client.post(reverse('posts:post_create'), {
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile(
+                name='thumb.gif', content=SMALL_GIF, content_type='image/gif'
+            ),
+        })
+        return Post.objects.order_by('-pk').first()
+
+    def test_thumbnail_is_not_generated_on_request(self):
+        """Пока миниатюры нет, выводится заглушка, а не картинка."""
+        post = self.create_post()
+        content = self.client.get(reverse('posts:posts')).content.decode()
+        self.assertIn('thumbnail-placeholder', content)
+        self.assertIsNone(thumbnails.lookup(post.image, 'card'))
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_thumbnail_generated_after_create(self):
+        """Миниатюра создается фоновой задачей после сохранения поста."""
+        self.client.get(reverse('posts:posts'))
+        post = self.create_post()
+        thumbnail = thumbnails.lookup(post.image, 'card')
+        self.assertIsNotNone(thumbnail)
+        content = self.client.get(reverse('posts:posts')).content.decode()
+        self.assertIn(thumbnail.url, content)
+        self.assertNotIn('thumbnail-placeholder', content)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_image_has_srcset(self):
+        """Картинка выводится со srcset, размерами и ленивой загрузкой."""
+        post = self.create_post()
+        content = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        ).content.decode()
+        srcset = ', '.join(
+            f'{thumbnails.lookup(post.image, size).url} {width}w'
+            for size, width in (('card', 960), ('card_640', 640),
+                                ('card_320', 320))
+        )
+        self.assertIn(f'srcset="{srcset}"', content)
+        self.assertIn('width="960" height="339" style="background: url('
+                      f'{post.image_placeholder}) center / cover', content)
+        self.assertIn('loading="lazy"', content)
+
+    def test_placeholder_shows_lqip(self):
+        """Пока миниатюр нет, в заглушке видна крошечная копия картинки."""
+        post = self.create_post()
+        content = self.client.get(reverse('posts:posts')).content.decode()
+        self.assertIn(f'url({post.image_placeholder})', content)
+
+    def test_backfill_images_command(self):
+        """backfill_images заполняет заглушки старых постов."""
+        post = self.create_post()
+        Post.objects.filter(pk=post.pk).update(image_placeholder='')
+        call_command('backfill_images', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertTrue(post.image_placeholder.startswith('data:image/'))
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_thumbnails_attached_with_one_lookup(self):
+        """Миниатюры всех постов страницы ищутся одним запросом."""
+        for _ in range(3):
+            self.create_post()
+        posts = list(Post.objects.all())
+        cache.clear()
+        with self.assertNumQueries(1):
+            thumbnails.attach(posts)
+        with self.assertNumQueries(0):
+            thumbnails.attach(posts)
+        for post in posts:
+            self.assertEqual(post.thumbnails['card'].url,
+                             thumbnails.lookup(post.image, 'card').url)
 
 
 class PaginatorViewsTest(TestCase):
@@ -201,6 +312,9 @@ class PaginatorViewsTest(TestCase):
                 group=cls.group
             )
 
+    def setUp(self):
+        cache.clear()
+
     def test_first_page_contains_ten_records(self):
         url_names = {
             reverse('posts:posts'): 'posts/index.html',
@@ -235,6 +349,104 @@ class PaginatorViewsTest(TestCase):
             self.assertEqual(len(
                 response.context['page_obj']), second_page)
 
+    def test_page_range_is_elided(self):
+        """Пагинатор выводит окно номеров страниц, а не все страницы."""
+        paginator = FeedPaginator(Post.objects.all(), 1)
+        page_range = list(paginator.get_elided_page_range(8))
+        ellipsis = paginator.ELLIPSIS
+        self.assertEqual(
+            page_range,
+            [1, 2, ellipsis, 5, 6, 7, 8, 9, 10, 11, ellipsis, 14, 15]
+        )
+        self.assertEqual(
+            list(paginator.get_elided_page_range(1)),
+            [1, 2, 3, 4, ellipsis, 14, 15]
+        )
+
+    def test_count_is_cached(self):
+        """Число записей ленты берется из кэша, а не из COUNT(*)."""
+        cache.clear()
+        posts_list = self.group.posts.all()
+        FeedPaginator(posts_list, self.first_page).count
+        with self.assertNumQueries(0):
+            paginator = FeedPaginator(posts_list, self.first_page)
+            self.assertEqual(paginator.count, self.pages)
+        response = self.client.get(
+            reverse('posts:group_posts', kwargs={'slug': self.group.slug})
+        )
+        self.assertContains(response, 'page-item active')
+
+
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовый заголовок',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.pages = 15
+        cls.first_page = settings.CONSTANT
+        for i in range(cls.pages):
+            Post.objects.create(
+                author=cls.user,
+                text=f'Тестовый текст поста {i}',
+                group=cls.group
+            )
+        cls.urls = (
+            reverse('posts:posts'),
+            reverse('posts:group_posts', kwargs={'slug': cls.group.slug}),
+            reverse('posts:profile', kwargs={'username': cls.user}),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_pages_follow_each_other(self):
+        """Курсоры next/prev обходят ленту без пропусков и повторов."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                first = self.client.get(url + '?cursor=').context['page_obj']
+                self.assertEqual(len(first), self.first_page)
+                self.assertFalse(first.has_previous())
+                second = self.client.get(
+                    url + f'?cursor={first.next_cursor}'
+                ).context['page_obj']
+                self.assertEqual(len(second), self.pages - self.first_page)
+                self.assertFalse(second.has_next())
+                self.assertEqual(
+                    [p.pk for p in first] + [p.pk for p in second],
+                    list(Post.objects.order_by('-pub_date', '-pk')
+                         .values_list('pk', flat=True))
+                )
+                back = self.client.get(
+                    url + f'?cursor={second.previous_cursor}'
+                ).context['page_obj']
+                self.assertEqual(list(back), list(first))
+                self.assertFalse(back.has_previous())
+
+    def test_broken_cursor_returns_first_page(self):
+        """Битый курсор отдает первую страницу."""
+        response = self.client.get(self.urls[0] + '?cursor=broken!')
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj[0], Post.objects.latest('pub_date'))
+
+    def test_crafted_cursor_returns_first_page(self):
+        """Курсор с невозможной датой или огромным id — тоже битый."""
+        latest = Post.objects.latest('pub_date')
+        tokens = {
+            'месяц 13': encode_cursor('n', '2022-13-01T00:00:00+00:00', 1),
+            'id 10**30': encode_cursor('n', latest.pub_date.isoformat(),
+                                       10 ** 30),
+            'id true': encode_cursor('n', latest.pub_date.isoformat(), True),
+        }
+        for name, token in tokens.items():
+            with self.subTest(name=name):
+                response = self.client.get(self.urls[0] + f'?cursor={token}')
+                self.assertEqual(response.context['page_obj'][0], latest)
+
 
 class CommentsViewsTest(TestCase):
     @classmethod
@@ -283,6 +495,60 @@ class CommentsViewsTest(TestCase):
             )
         )
 
+    @override_settings(COMMENTS_PER_PAGE=3)
+    def test_comments_are_paged(self):
+        """Комментарии выводятся страницами с авторами одним запросом."""
+        for i in range(5):
+            Comment.objects.create(
+                post=self.post, author=self.user, text=f'Комментарий {i}'
+            )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 5)
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        comments = response.context['comments']
+        self.assertEqual(len(comments), 3)
+        self.assertEqual(comments[0].text, 'Комментарий 0')
+        url = reverse('posts:comments', kwargs={'post_id': self.post.pk})
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                url + f'?cursor={comments.next_cursor}'
+            )
+        self.assertTemplateUsed(response, 'includes/comment_list.html')
+        self.assertEqual(
+            [c.text for c in response.context['comments']],
+            ['Комментарий 3', 'Комментарий 4']
+        )
+        Comment.objects.filter(post=self.post).first().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 4)
+
+
+class CacheCommitTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='auth')
+
+    def test_page_rendered_before_commit_is_not_kept(self):
+        """Страница, собранная до фиксации записи, после нее не отдается.
+
+        Поколение еще раз меняется после фиксации: страница со старыми
+        данными, которую соседний процесс сохранил до нее, остается
+        под прежним ключом.
+        """
+        url = reverse('posts:posts')
+        with transaction.atomic():
+            post = Post.objects.create(text='Первая версия', author=self.user)
+            self.assertIn('Первая версия',
+                          self.client.get(url).content.decode())
+            Post.objects.filter(pk=post.pk).update(
+                text='Вторая версия', updated_at=timezone.now()
+            )
+        content = self.client.get(url).content.decode()
+        self.assertIn('Вторая версия', content)
+        self.assertNotIn('Первая версия', content)
+
 
 class CacheViewsTest(TestCase):
     @classmethod
@@ -308,15 +574,152 @@ class CacheViewsTest(TestCase):
     def test_cache_index(self):
         """Тестирование хеширования Главной страницы."""
         response_1 = self.authorized_client.get(reverse('posts:posts')).content
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        response_2 = self.authorized_client.get(reverse('posts:posts')).content
+        self.assertEqual(response_2, response_1)
         Post.objects.create(
             text='test_new_post',
             author=self.user,
         )
-        response_2 = self.authorized_client.get(reverse('posts:posts')).content
-        self.assertEqual(response_2, response_1)
-        cache.clear()
         response_3 = self.authorized_client.get(reverse('posts:posts')).content
         self.assertNotEqual(response_2, response_3)
+        self.assertIn('test_new_post', response_3.decode())
+
+    def test_cache_invalidated_by_scope(self):
+        """Запись сбрасывает только страницы своих областей."""
+        other = Group.objects.create(
+            title='Другая группа', slug='other', description='Описание'
+        )
+        group_url = reverse('posts:group_posts',
+                            kwargs={'slug': self.group.slug})
+        profile_url = reverse('posts:profile',
+                              kwargs={'username': self.user.username})
+        group_page = self.client.get(group_url).content
+        profile_page = self.client.get(profile_url).content
+        post = Post.objects.create(
+            text='Пост в другой группе', author=self.user, group=other
+        )
+        self.assertEqual(self.client.get(group_url).content, group_page)
+        self.assertIn('Пост в другой группе',
+                      self.client.get(profile_url).content.decode())
+        self.assertNotEqual(profile_page, self.client.get(profile_url).content)
+        post.group = self.group
+        post.save()
+        self.assertIn('Пост в другой группе',
+                      self.client.get(group_url).content.decode())
+
+    def test_shared_page_gets_personal_fragments(self):
+        """Общая страница из кэша дополняется фрагментами пользователя."""
+        url = reverse('posts:profile', kwargs={'username': 'auth'})
+        Follow.objects.create(user=self.user, author=self.post.author)
+        anonymous = self.client.get(url).content.decode()
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        authorized = self.authorized_client.get(url).content.decode()
+        self.assertIn('Войти', anonymous)
+        self.assertIn('Подписаться', anonymous)
+        self.assertIn(self.post.text, authorized)
+        self.assertIn('Пользователь: Linnaip', authorized)
+        self.assertIn('Отписаться', authorized)
+        self.assertNotIn('<!--personal', authorized)
+
+    def test_cached_post_detail_without_queries(self):
+        """Страница поста из кэша отдается без запросов к базе."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        page = self.client.get(url).content
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).content, page)
+
+    def test_cached_post_detail_follows_author_counters(self):
+        """Страница поста сбрасывается с новым постом ее автора."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.assertIn('<span >1</span>', self.client.get(url).content.decode())
+        Post.objects.create(author=self.post.author, text='Второй пост')
+        self.assertIn('<span >2</span>', self.client.get(url).content.decode())
+
+    def test_renamed_author_profile_is_not_served(self):
+        """После смены имени старый адрес профиля не отдается из кэша."""
+        url = reverse('posts:profile', kwargs={'username': 'auth'})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        author = User.objects.get(username='auth')
+        author.username = 'renamed'
+        author.first_name = 'Новое имя'
+        author.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertIn('Новое имя', self.client.get(
+            reverse('posts:posts')
+        ).content.decode())
+
+    def test_reused_username_gets_new_profile(self):
+        """Профиль нового владельца имени не берется из кэша."""
+        url = reverse('posts:profile', kwargs={'username': 'ghost'})
+        User.objects.create_user(username='ghost', first_name='Прежний')
+        self.assertIn('Прежний', self.client.get(url).content.decode())
+        User.objects.get(username='ghost').delete()
+        User.objects.create_user(username='ghost', first_name='Новый')
+        self.assertIn('Новый', self.client.get(url).content.decode())
+
+    def test_changed_group_slug_is_not_served(self):
+        """После смены адреса группы старый адрес не отдается из кэша."""
+        url = reverse('posts:group_posts', kwargs={'slug': 'test-slug'})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.group.slug = 'new-slug'
+        self.group.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_scope_keys_do_not_contain_slug(self):
+        """Адрес группы не попадает в ключи кэша."""
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            group = Group.objects.create(
+                title='Котики', slug='Тестовый слаг', description='Описание'
+            )
+            Post.objects.create(author=self.user, text='Кот', group=group)
+
+    def test_comment_form_is_personal(self):
+        """Форма комментария с CSRF-токеном не попадает в общий кэш."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.assertNotIn('csrfmiddlewaretoken',
+                         self.client.get(url).content.decode())
+        response = self.authorized_client.get(url)
+        self.assertIn('csrfmiddlewaretoken', response.content.decode())
+        self.assertIn('csrftoken', response.cookies)
+
+    def test_forged_fragment_is_dropped(self):
+        """Метка без подписи сервера не рендерится."""
+        request = RequestFactory().get('/')
+        request.user = self.user
+        content = stitch(request, '<!--personal header forged:token-->')
+        self.assertEqual(content, '')
+
+    def test_post_cards_cached_by_version(self):
+        """Карточка берется из кэша, пока пост не изменен."""
+        template = 'posts/includes/post_card.html'
+        render_cards(Post.objects.all(), template)
+        posts = list(Post.objects.all())
+        with self.assertNumQueries(0):
+            cards = render_cards(posts, template)
+        self.assertIn(self.post.text, cards[0])
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        self.assertIn(self.post.text, render_cards(Post.objects.all(),
+                                                   template)[0])
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Отредактированный текст'
+        post.save()
+        self.assertIn('Отредактированный текст',
+                      render_cards(Post.objects.all(), template)[0])
+
+    def test_group_change_refreshes_cards(self):
+        """Смена названия группы обновляет карточки ее постов."""
+        template = 'posts/includes/profile_card.html'
+        Post.objects.filter(pk=self.post.pk).update(group=self.group)
+        render_cards(Post.objects.all(), template)
+        self.group.title = 'Новое название'
+        self.group.save()
+        self.assertIn('Новое название',
+                      render_cards(Post.objects.all(), template)[0])
+        self.group.delete()
+        self.assertIn('Группа: None',
+                      render_cards(Post.objects.all(), template)[0])
 
 
 class FollowViewsTests(TestCase):
@@ -379,3 +782,67 @@ class FollowViewsTests(TestCase):
                 author=self.user
             ).exists()
         )
+
+    def test_new_post_is_fanned_out(self):
+        """Новый пост автора попадает в ленты подписчиков."""
+        Follow.objects.create(user=self.user_follower, author=self.user)
+        post = Post.objects.create(author=self.user, text='Новый пост')
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=self.user_follower, post=post
+            ).exists()
+        )
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['page_obj'][0], post)
+
+    def test_unfollow_trims_timeline(self):
+        """После отписки посты автора пропадают из ленты."""
+        Follow.objects.create(user=self.user_follower, author=self.user)
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow',
+                    kwargs={'username': self.user.username}))
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.user_follower).exists()
+        )
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_celebrity_posts_are_pulled_at_read(self):
+        """Посты знаменитостей не раскладываются, а читаются напрямую."""
+        Follow.objects.create(user=self.user_follower, author=self.user)
+        post = Post.objects.create(author=self.user, text='Новый пост')
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']), [post, self.post]
+        )
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0, TIMELINE_BACKFILL=2,
+                       TIMELINE_BATCH_SIZE=2)
+    def test_pull_copies_whole_gap(self):
+        """Посты знаменитости между чтениями ленты переносятся все.
+
+        Их больше TIMELINE_BACKFILL, а двое на границе пачки
+        опубликованы в одно время.
+        """
+        Follow.objects.create(user=self.user_follower, author=self.user)
+        self.authorized_client.get(reverse('posts:follow_index'))
+        posts = [
+            Post.objects.create(author=self.user, text=f'Пост {number}')
+            for number in range(5)
+        ]
+        Post.objects.filter(pk=posts[2].pk).update(
+            pub_date=posts[1].pub_date
+        )
+        self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(
+                user=self.user_follower
+            ).values_list('post', flat=True)),
+            {self.post.pk, *(post.pk for post in posts)}
+        )
+        self.assertEqual(
+            Follow.objects.get(user=self.user_follower).pulled_until,
+            posts[4].pub_date
+        )
@@ -0,0 +1,11 @@
+"""Общие помощники тестов приложения posts."""
+from django.core.files.base import ContentFile
+
+from ..models import Post
+
+
+def create_post(author, name, content):
+    """Пост автора с картинкой name из байтов content."""
+    post = Post(author=author, text='Пост')
+    post.image.save(name, ContentFile(content))
+    return post
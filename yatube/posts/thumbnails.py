@@ -0,0 +1,121 @@
+"""Миниатюры картинок постов.
+
+Миниатюры всех размеров из POST_THUMBNAILS создаются в фоне после
+сохранения поста (core.tasks). На запросе миниатюра только ищется в
+хранилище ключей sorl и никогда не создается: пока ее нет, шаблон
+выводит заглушку. Готовые миниатюры обновляют версию поста, поэтому
+карточки и страницы с заглушкой сбрасываются.
+
+attach() ищет миниатюры всех постов страницы одним get_many и
+записывает их в post.thumbnails, откуда их читает тег post_image.
+"""
+from collections import namedtuple
+
+from django.conf import settings as s
+from django.utils import timezone
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from core import tasks
+
+from .models import Post
+from .signals import bump_post_scopes
+
+Thumbnail = namedtuple('Thumbnail', 'url width height')
+
+
+def _options(source, options):
+    """Дополняет опции так же, как ThumbnailBackend.get_thumbnail."""
+    backend = default.backend
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def thumbnail_file(image, size):
+    """Файл миниатюры размера size без обращения к хранилищу."""
+    geometry, options = s.POST_THUMBNAILS[size]
+    source = ImageFile(image)
+    name = default.backend._get_thumbnail_filename(
+        source, geometry, _options(source, options)
+    )
+    return ImageFile(name, default.storage)
+
+
+def lookup(image, size):
+    """Готовая миниатюра картинки или None, если ее еще нет."""
+    if not image:
+        return None
+    return default.kvstore.get(thumbnail_file(image, size))
+
+
+def _get_many_raw(keys):
+    """Значения хранилища sorl по ключам: кэш, затем одна выборка из БД.
+
+    Повторяет KVStore._get_raw из cached_db_kvstore для пачки ключей.
+    """
+    kv_cache = default.kvstore.cache
+    values = kv_cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        stored = dict(
+            KVStore.objects.filter(key__in=missing).values_list('key', 'value')
+        )
+        fetched = {key: stored.get(key, EMPTY_VALUE) for key in missing}
+        kv_cache.set_many(fetched, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(fetched)
+    return {
+        key: value for key, value in values.items()
+        if value is not EMPTY_VALUE
+    }
+
+
+def attach(posts):
+    """Записывает в post.thumbnails готовые миниатюры.
+
+    Ключ словаря — размер из POST_THUMBNAILS, значение — Thumbnail
+    с адресом и размерами или None, если миниатюры еще нет.
+    """
+    wanted = {}
+    for post in posts:
+        post.thumbnails = dict.fromkeys(s.POST_THUMBNAILS)
+        if not post.image:
+            continue
+        for size in s.POST_THUMBNAILS:
+            key = add_prefix(thumbnail_file(post.image, size).key)
+            # Одна картинка может быть у нескольких постов
+            wanted.setdefault(key, []).append((post, size))
+    for key, value in _get_many_raw(list(wanted)).items():
+        image = deserialize_image_file(value)
+        for post, size in wanted[key]:
+            post.thumbnails[size] = Thumbnail(image.url, *image.size)
+    return posts
+
+
+def generate(post_id):
+    """Создает миниатюры картинки поста всех размеров."""
+    post = Post.objects.filter(pk=post_id).select_related('author').first()
+    if post is None or not post.image:
+        return
+    for geometry, options in s.POST_THUMBNAILS.values():
+        get_thumbnail(post.image, geometry, **options)
+    Post.objects.filter(pk=post.pk).update(updated_at=timezone.now())
+    bump_post_scopes(post)
+
+
+def schedule(post):
+    """Ставит создание миниатюр поста в фоновую очередь."""
+    if post.image:
+        tasks.submit(generate, post.pk)
@@ -0,0 +1,174 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Пост автора раскладывается по лентам подписчиков в момент публикации.
+Посты авторов с числом подписчиков больше TIMELINE_FANOUT_LIMIT не
+раскладываются, а переносятся в ленту подписчика, когда он ее читает.
+Записи ленты хранят копию даты поста, поэтому лента читается по
+индексу (user, pub_date) без сортировки.
+"""
+from datetime import datetime
+
+from django.conf import settings as s
+from django.db.models import F
+from django.utils import timezone
+
+from .counters import is_above
+from .models import Follow, Post, TimelineEntry
+
+# Граница переноса для знаменитости без постов: новыми будут все
+PULL_START = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def is_celebrity(author_id):
+    """Автор, чьи посты не раскладываются по лентам подписчиков."""
+    return is_above(author_id, s.TIMELINE_FANOUT_LIMIT)
+
+
+def fan_out(post):
+    """Добавляет новый пост в ленты подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in follower_ids.iterator()),
+        batch_size=s.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки.
+
+    Для знаменитости сразу ставится граница переноса, и чтение ленты
+    дальше берет только посты новее нее.
+    """
+    newest = _copy_posts(user_id, Post.objects.filter(author_id=author_id))
+    if is_celebrity(author_id):
+        Follow.objects.filter(user_id=user_id, author_id=author_id).update(
+            pulled_until=newest or PULL_START
+        )
+
+
+def _copy_posts(user_id, posts):
+    """Копирует в ленту последние TIMELINE_BACKFILL постов из posts.
+
+    Возвращает дату самого нового из них или None.
+    """
+    rows = list(posts.order_by('-pub_date', '-pk').values_list(
+        'pk', 'pub_date'
+    )[:s.TIMELINE_BACKFILL])
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in rows],
+        batch_size=s.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    return rows[0][1] if rows else None
+
+
+def trim(user_id, author_id):
+    """Убирает из ленты посты автора после отписки."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def _pull_after(user_id, follow):
+    """Переносит все посты автора новее follow.pulled_until.
+
+    Посты идут от старых к новым пачками по TIMELINE_BATCH_SIZE, и
+    граница сдвигается после каждой пачки. Пачка захватывает все посты
+    с датой ее последнего поста, чтобы граница не отрезала посты с той
+    же датой.
+    """
+    posts = Post.objects.filter(author_id=follow.author_id)
+    pulled_until = follow.pulled_until
+    while True:
+        rows = list(posts.filter(pub_date__gt=pulled_until).order_by(
+            'pub_date', 'pk'
+        ).values_list('pk', 'pub_date')[:s.TIMELINE_BATCH_SIZE])
+        if not rows:
+            return
+        last_date = rows[-1][1]
+        if len(rows) == s.TIMELINE_BATCH_SIZE:
+            rows = posts.filter(
+                pub_date__gt=pulled_until, pub_date__lte=last_date
+            ).values_list('pk', 'pub_date')
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=post_id,
+                           pub_date=pub_date)
+             for post_id, pub_date in rows],
+            batch_size=s.TIMELINE_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        pulled_until = last_date
+        Follow.objects.filter(pk=follow.pk).update(pulled_until=pulled_until)
+
+
+def _pull_new(user_id, follows):
+    """Переносит новые посты всех знаменитостей одним запросом.
+
+    Возвращает False, если их больше TIMELINE_BATCH_SIZE: такой разрыв
+    переносится по авторам. Иначе перенесены все посты новее границ,
+    и границы всех подписок сдвигаются к самому новому из них.
+    """
+    rows = list(Post.objects.filter(
+        author__following__user_id=user_id,
+        author__following__pulled_until__lt=F('pub_date'),
+        author__counter__followers_count__gt=s.TIMELINE_FANOUT_LIMIT,
+    ).order_by().values_list('pk', 'pub_date')[:s.TIMELINE_BATCH_SIZE + 1])
+    if len(rows) > s.TIMELINE_BATCH_SIZE:
+        return False
+    if rows:
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=post_id,
+                           pub_date=pub_date)
+             for post_id, pub_date in rows],
+            ignore_conflicts=True
+        )
+        newest = max(pub_date for _, pub_date in rows)
+        follows.filter(pulled_until__lt=newest).update(pulled_until=newest)
+    return True
+
+
+def pull(user):
+    """Переносит в ленту новые посты авторов-знаменитостей.
+
+    Граница переноса хранится в Follow.pulled_until и ставится при
+    подписке. Новые посты всех знаменитостей читаются одним запросом,
+    поэтому без них чтение ленты стоит двух запросов, сколько бы
+    знаменитостей ни было в подписках, и ничего не пишет. Подписки без
+    границы (автор стал знаменитостью позже) при первом чтении получают
+    последние TIMELINE_BACKFILL постов, как при подписке.
+    """
+    follows = Follow.objects.filter(
+        user=user,
+        author__counter__followers_count__gt=s.TIMELINE_FANOUT_LIMIT
+    )
+    for follow in follows.filter(pulled_until=None).only('author_id'):
+        newest = _copy_posts(
+            user.pk, Post.objects.filter(author_id=follow.author_id)
+        )
+        Follow.objects.filter(pk=follow.pk).update(
+            pulled_until=newest or PULL_START
+        )
+    if _pull_new(user.pk, follows):
+        return
+    for follow in follows.only('author_id', 'pulled_until'):
+        _pull_after(user.pk, follow)
+
+
+def get_timeline(user):
+    """Посты ленты подписок пользователя.
+
+    Порядок задают поля feed_date и feed_post записи ленты: по ним же
+    нужно строить курсор пагинации.
+    """
+    pull(user)
+    return Post.objects.filter(timeline_entries__user=user).annotate(
+        feed_date=F('timeline_entries__pub_date'),
+        feed_post=F('timeline_entries__post'),
+    ).order_by('-feed_date', '-feed_post')
@@ -1,10 +1,230 @@
+import base64
+import hashlib
+import json
+from collections.abc import Sequence
+
 from django.conf import settings as s
-from django.core.paginator import Paginator
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+CURSOR_NEXT = 'n'
+CURSOR_PREVIOUS = 'p'
+# Диапазон INTEGER в SQLite: больший id из курсора база не примет
+ROW_ID_MIN, ROW_ID_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def encode_cursor(*values):
+    """Упаковывает значения ключа в непрозрачный токен для URL."""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Распаковывает токен курсора, для битого токена возвращает None."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode())
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def is_row_id(value):
+    """Проверяет, что значение из курсора годится в id строки."""
+    return (isinstance(value, int) and not isinstance(value, bool)
+            and ROW_ID_MIN <= value <= ROW_ID_MAX)
+
+
+class FeedPage(Page):
+    """Страница ленты с укороченным списком номеров страниц."""
+
+    @property
+    def elided_page_range(self):
+        return self.paginator.get_elided_page_range(self.number)
+
+
+class FeedPaginator(Paginator):
+    """Paginator с кэшированным числом записей и окном номеров страниц."""
+
+    ELLIPSIS = '…'
+
+    @cached_property
+    def count(self):
+        """Берет COUNT(*) из кэша, считая его не чаще FEED_COUNT_TIMEOUT."""
+        query = getattr(self.object_list, 'query', None)
+        if query is None:
+            return super().count
+        digest = hashlib.md5(str(query).encode()).hexdigest()
+        key = f'feed-count:{digest}'
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, s.FEED_COUNT_TIMEOUT)
+        return count
+
+    def page(self, number):
+        """Страница по номеру.
+
+        Срез не ограничивается кэшированным числом записей, иначе
+        устаревший count скрыл бы новые посты.
+        """
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(
+            self.object_list[bottom:bottom + self.per_page], number, self
+        )
+
+    def _get_page(self, *args, **kwargs):
+        return FeedPage(*args, **kwargs)
+
+    def get_elided_page_range(self, number=1, on_each_side=3, on_ends=2):
+        """Номера страниц вокруг текущей и по краям, пропуски — ELLIPSIS."""
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > (1 + on_each_side + on_ends) + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < (self.num_pages - on_each_side - on_ends) - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(self.num_pages - on_ends + 1, self.num_pages + 1)
+        else:
+            yield from range(number + 1, self.num_pages + 1)
+
+
+class CursorPage(Sequence):
+    """Страница курсорной пагинации с интерфейсом, как у Page."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, paginator,
+                 next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Cursor page of %s>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Пагинация по ключу (pub_date, id): без COUNT(*) и OFFSET."""
+
+    def __init__(self, object_list, per_page, key='pub_date',
+                 descending=True, tiebreak='pk'):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.key = key
+        self.tiebreak = tiebreak
+        self.descending = descending
+
+    def _ordering(self, reverse=False):
+        prefix = '-' if self.descending != reverse else ''
+        return prefix + self.key, prefix + self.tiebreak
+
+    def _after(self, value, pk, reverse=False):
+        """Условие «строго после (value, pk)» в порядке выдачи."""
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        return (
+            Q(**{f'{self.key}__{lookup}': value})
+            | Q(**{self.key: value, f'{self.tiebreak}__{lookup}': pk})
+        )
+
+    def _cursor(self, direction, obj):
+        value = getattr(obj, self.key)
+        return encode_cursor(
+            direction, value.isoformat(), getattr(obj, self.tiebreak)
+        )
+
+    def _parse(self, token):
+        values = decode_cursor(token) if token else None
+        if not values or len(values) != 3:
+            return None
+        direction, value, pk = values
+        try:
+            value = parse_datetime(value) if isinstance(value, str) else None
+        except ValueError:
+            # Формат верный, но дата невозможная, например 13-й месяц
+            return None
+        if (direction not in (CURSOR_NEXT, CURSOR_PREVIOUS)
+                or value is None or not is_row_id(pk)):
+            return None
+        return direction, value, pk
+
+    def get_page(self, token):
+        """Возвращает страницу после или перед курсором.
+
+        Битый или пустой токен отдает первую страницу.
+        """
+        cursor = self._parse(token)
+        queryset = self.object_list
+        if cursor is None:
+            rows = list(
+                queryset.order_by(*self._ordering())[:self.per_page + 1]
+            )
+            has_next, has_previous = len(rows) > self.per_page, False
+            rows = rows[:self.per_page]
+        elif cursor[0] == CURSOR_NEXT:
+            _, value, pk = cursor
+            rows = list(
+                queryset.filter(self._after(value, pk))
+                .order_by(*self._ordering())[:self.per_page + 1]
+            )
+            has_next, has_previous = len(rows) > self.per_page, True
+            rows = rows[:self.per_page]
+        else:
+            _, value, pk = cursor
+            rows = list(
+                queryset.filter(self._after(value, pk, reverse=True))
+                .order_by(*self._ordering(reverse=True))[:self.per_page + 1]
+            )
+            has_next, has_previous = True, len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self._cursor(CURSOR_NEXT, rows[-1])
+        if rows and has_previous:
+            previous_cursor = self._cursor(CURSOR_PREVIOUS, rows[0])
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
 
+def get_page_context(request, posts_list, key='pub_date', tiebreak='pk'):
+    """Код работы пагинатора.
 
-def get_page_context(request, posts_list):
-    """Код работы пагинатора."""
-    paginator = Paginator(posts_list, s.CONSTANT)
+    Параметр ?cursor= или PAGINATION_MODE = 'cursor' включают курсорную
+    пагинацию, иначе используется постраничная. key и tiebreak задают
+    порядок курсора и должны совпадать с сортировкой posts_list.
+    """
+    cursor = request.GET.get('cursor')
+    if cursor is not None or s.PAGINATION_MODE == 'cursor':
+        return CursorPaginator(
+            posts_list, s.CONSTANT, key=key, tiebreak=tiebreak
+        ).get_page(cursor)
+    paginator = FeedPaginator(posts_list, s.CONSTANT)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     return page_obj
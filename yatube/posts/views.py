@@ -1,14 +1,21 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
-from django.views.decorators.cache import cache_page
 
+from core.cache import cache_page_by_generation, depend_on
+
+from . import scopes, thumbnails
+from .counters import get_counter
 from .forms import PostForm, CommentForm
 from .models import Group, Post, Comment, User, Follow
-from .utils import get_page_context
+from .search import SearchPaginator, match_expression
+from .timeline import get_timeline
+from .utils import CursorPaginator, get_page_context
 
 
-@cache_page(20)
+@cache_page_by_generation(lambda request: (scopes.INDEX,))
 def index(request):
     """Главная страница."""
     posts_list = Post.objects.select_related('author', 'group')
@@ -19,10 +26,14 @@ def index(request):
     return render(request, 'posts/index.html', context)
 
 
+@cache_page_by_generation(
+    lambda request, slug: (scopes.group_slug(slug),)
+)
 def group_posts(request, slug):
     """Выводит шаблон с группами постов."""
     group = get_object_or_404(Group, slug=slug)
-    posts_list = group.posts.all()
+    depend_on(request, scopes.group(group.pk))
+    posts_list = group.posts.select_related('author', 'group')
     page_obj = get_page_context(request, posts_list)
     context = {
         'group': group,
@@ -31,44 +42,87 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@cache_page_by_generation(
+    lambda request, username: (scopes.username(username),)
+)
 def profile(request, username):
     """Выводит шаблон профайла пользователя."""
-    author = get_object_or_404(User, username=username)
-    posts_list = Post.objects.filter(author=author).order_by('-pub_date')
-    count_list = Post.objects.filter(author=author).count()
+    author = get_object_or_404(
+        User.objects.select_related('counter'), username=username
+    )
+    depend_on(request, scopes.author(author.pk))
+    counter = get_counter(author)
+    posts_list = Post.objects.filter(author=author).select_related(
+        'author', 'group'
+    ).order_by('-pub_date')
     page_obj = get_page_context(request, posts_list)
-    if request.user.is_authenticated:
-        following = Follow.objects.filter(
-            user=request.user, author=author
-        ).exists()
-    else:
-        following = False
     context = {
         'author': author,
         'page_obj': page_obj,
-        'count_list': count_list,
-        'following': following
+        'count_list': counter.posts_count,
+        'counter': counter,
     }
     return render(request, 'posts/profile.html', context)
 
 
+def search_posts(request):
+    """Полнотекстовый поиск по постам."""
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if match_expression(query):
+        page_obj = SearchPaginator(query, settings.CONSTANT).get_page(
+            request.GET.get('cursor')
+        )
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@cache_page_by_generation(lambda request, post_id: (scopes.post(post_id),))
 def post_detail(request, post_id):
-    """Выводит шаблон поста пользователя."""
-    post = get_object_or_404(Post, id=post_id)
+    """Выводит шаблон поста пользователя.
+
+    Страница зависит от комментариев поста и от счетчиков автора.
+    """
+    post = get_object_or_404(
+        Post.objects.select_related('author__counter', 'group'), id=post_id
+    )
+    depend_on(request, scopes.author(post.author_id))
+    thumbnails.attach([post])
     author = post.author
-    count_list = Post.objects.filter(author=author).count()
-    comments = Comment.objects.filter(post=post).all()
-    form = CommentForm()
+    counter = get_counter(author)
+    comments = get_comments_page(request, post)
     context = {
         'author': author,
         'post': post,
-        'count_list': count_list,
-        'form': form,
+        'count_list': counter.posts_count,
+        'counter': counter,
         'comments': comments,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def get_comments_page(request, post):
+    """Страница комментариев поста с авторами, от старых к новым."""
+    comments_list = Comment.objects.filter(post=post).select_related('author')
+    paginator = CursorPaginator(
+        comments_list, settings.COMMENTS_PER_PAGE, descending=False
+    )
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+def comments(request, post_id):
+    """Фрагмент со следующей страницей комментариев."""
+    post = get_object_or_404(Post.objects.only('pk'), id=post_id)
+    context = {
+        'post': post,
+        'comments': get_comments_page(request, post),
+    }
+    return render(request, 'includes/comment_list.html', context)
+
+
 @login_required
 def post_create(request):
     """Выводит шаблон создания поста."""
@@ -78,7 +132,9 @@ def post_create(request):
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        with transaction.atomic():
+            post.save()
+            thumbnails.schedule(post)
         return redirect('posts:profile', post.author)
     context = {
         'form': form,
@@ -102,7 +158,10 @@ def post_edit(request, post_id):
             return redirect('posts:post_detail', post_id=post.id)
     if request.method == 'POST':
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
+                if 'image' in form.changed_data:
+                    thumbnails.schedule(post)
         return redirect('posts:post_detail', post_id=post.id)
     return render(request, 'posts/create_post.html', context)
 
@@ -115,14 +174,17 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with transaction.atomic():
+            comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    posts_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_page_context(request, posts_list)
+    posts_list = get_timeline(request.user).select_related('author', 'group')
+    page_obj = get_page_context(
+        request, posts_list, key='feed_date', tiebreak='feed_post'
+    )
     context = {
         'page_obj': page_obj
     }
@@ -134,7 +196,8 @@ def profile_follow(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
     if user != author:
-        Follow.objects.get_or_create(author=author, user=user)
+        with transaction.atomic():
+            Follow.objects.get_or_create(author=author, user=user)
     return redirect(reverse('posts:profile', args=[username]))
 
 
@@ -143,5 +206,6 @@ def profile_unfollow(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
     follower = Follow.objects.filter(author=author, user=user)
-    follower.delete()
+    with transaction.atomic():
+        follower.delete()
     return redirect('posts:profile', username)
@@ -18,12 +18,89 @@ ALLOWED_HOSTS = [
     'Linnaip.pythonanywhere.com',
 ]
 
-# Кэширование
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Кэширование. В разработке и тестах кэш свой у процесса, в боевом
+# режиме — общий для всех воркеров на машине, см. core.sqlite_cache
+if DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.sqlite_cache.SQLiteCache',
+            'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+            'OPTIONS': {'MAX_SIZE': 256 * 1024 * 1024},
+        }
     }
+# Метрики запросов для Prometheus, см. core.metrics. Отдаются только
+# этим адресам: за обратным прокси не пробрасывайте /metrics наружу
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+# Куда воркеры сбрасывают снимки метрик; None — /metrics показывает
+# только свой процесс
+METRICS_DIR = None if DEBUG else os.path.join(BASE_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = 5
+# Журнал медленных SQL-запросов, см. core.slow_queries. Порог в
+# секундах; None выключает журнал. В файл пишут все воркеры, поэтому
+# его ротирует внешний logrotate (без copytruncate): WatchedFileHandler
+# замечает переименование и открывает новый файл
+SLOW_QUERY_THRESHOLD = 0.1
+SLOW_QUERY_SAMPLE_RATE = 1.0
+SLOW_QUERY_MAX_PER_MINUTE = 60
+SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'slow_queries.log')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'core.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+# Страницы сбрасываются по событиям (core.cache), таймаут только
+# вытесняет давно не запрашиваемые версии
+PAGE_CACHE_TIMEOUT = 60 * 60 * 6
+# Сколько еще секунд отдавать устаревшую страницу, пока ее пересобирают
+PAGE_CACHE_STALE_TIMEOUT = 60 * 60
+# Блокировка пересборки и ожидание чужой пересборки при промахе
+PAGE_CACHE_LOCK_TIMEOUT = 30
+PAGE_CACHE_WAIT = 5
+# Карточки постов кэшируются по версии поста, см. posts.cards
+POST_CARD_TIMEOUT = 60 * 60 * 24
+# Размеры миниатюр картинок постов: имя -> (геометрия, опции sorl).
+# Создаются в фоне после сохранения поста, см. posts.thumbnails
+POST_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+    'card_640': ('640x226', {'crop': 'center', 'upscale': True}),
+    'card_320': ('320x113', {'crop': 'center', 'upscale': True}),
+}
+# Миниатюры одной картинки разной ширины для srcset, от большей
+POST_THUMBNAIL_SRCSET = {
+    'card': ('card', 'card_640', 'card_320'),
 }
+# Загруженные картинки постов уменьшаются и хранятся в WebP,
+# см. posts.images
+POST_IMAGE_MAX_SIDE = 2048
+POST_IMAGE_MAX_PIXELS = 40_000_000
+POST_IMAGE_QUALITY = 80
+# Пул потоков для фоновых задач, см. core.tasks
+BACKGROUND_WORKERS = 2
+BACKGROUND_TASKS_EAGER = False
 # EmailBackend
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
@@ -32,6 +109,17 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:posts'
 CONSTANT = 10
+# 'pages' — постраничная пагинация, 'cursor' — по ключу (pub_date, id)
+PAGINATION_MODE = 'pages'
+# Сколько секунд кэшируется число записей ленты
+FEED_COUNT_TIMEOUT = 60
+# Авторы с большим числом подписчиков не раскладываются по лентам
+# при публикации, их посты подмешиваются в ленту при чтении
+TIMELINE_FANOUT_LIMIT = 1000
+# Сколько последних постов автора попадает в ленту при подписке
+TIMELINE_BACKFILL = 100
+TIMELINE_BATCH_SIZE = 500
+COMMENTS_PER_PAGE = 20
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 # Application definition
 
@@ -52,6 +140,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'core.metrics.MetricsMiddleware',
+    'core.slow_queries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +149,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.PersonalFragmentsMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -131,3 +222,11 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Раздача MEDIA_ROOT, см. core.media. Имена файлов не переиспользуются,
+# поэтому браузер кэширует их как immutable
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+# 'X-Sendfile' (Apache, lighttpd) или 'X-Accel-Redirect' (nginx):
+# файл отдает фронтовой сервер. Для nginx MEDIA_SENDFILE_URL —
+# internal location с alias на MEDIA_ROOT
+MEDIA_SENDFILE_HEADER = None
+MEDIA_SENDFILE_URL = '/protected-media/'